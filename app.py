@@ -1,276 +1,74 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template
 from flask_cors import CORS
 import os
-import json
 import threading
 import time
+import uuid
 import logging
-from pathlib import Path
 import queue
+from werkzeug.utils import secure_filename
 
-# Import the core functionality from the original script
-from lastfm_artwork_manager import (
-    ConfigManager, LastFMAPIAuth, get_album_info, get_playlist_info, 
-    get_artist_info, setup_webdriver, perform_login, perform_upload,
-    download_image, sanitize_filename, search_spotify_album, search_itunes_album,
-    get_album_art_url
+# Job execution lives in worker.py so it can also run in separate processes
+from worker import (
+    Worker, config_manager, store, jobs, TRACE_DIR, BACKLOG_PATH, IMPORTS_DIR,
+    read_missing_artwork, discard_job
 )
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+from history_import import HISTORY_EXTENSIONS
+from pipeline import SOURCE_TYPES
+from sweeps import RecheckBacklog, SweepScheduler
+from metrics import JOBS, render_metrics
+from logsetup import setup_logging, log_file_path, process_log_file
+import tracing
+from prometheus_client import CONTENT_TYPE_LATEST
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("server.log"),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging: JSON lines in the config directory plus text on stderr,
+# written by a background thread. With a shared job queue there may be several
+# web processes, and each needs its own file for size based rotation to be safe
+setup_logging(process_log_file(config_manager, 'web') if store.shared else log_file_path(config_manager))
 logger = logging.getLogger(__name__)
 
-# Initialize configuration manager
-config_manager = ConfigManager()
-
 # Queue for job status updates
 job_status_queue = queue.Queue()
 
-# Dictionary to store job status
-jobs = {}
+# 'inline' runs each job in a thread of this process; 'external' only queues
+# jobs for `python -m worker` processes sharing JOB_QUEUE_URL
+JOB_EXECUTION = os.environ.get('JOB_EXECUTION', 'inline')
 
-def process_albums(job_id, source_type, source_value, lastfm_username=None, lastfm_sources=None, 
-                  check_only=False, lastfm_email=None, lastfm_password=None):
-    """Process albums in a background thread"""
-    logger.info(f"Job {job_id} status: {jobs[job_id]}")
+inline_worker = Worker(store)
 
-    try:
-        jobs[job_id]['status'] = 'running'
-        jobs[job_id]['progress'] = 0
-        jobs[job_id]['message'] = 'Initializing...'
-        
-        # Extract credentials from config
-        credentials = config_manager.config["credentials"]
-        SPOTIPY_CLIENT_ID = credentials["SPOTIPY_CLIENT_ID"]
-        SPOTIPY_CLIENT_SECRET = credentials["SPOTIPY_CLIENT_SECRET"]
-        LASTFM_API_KEY = credentials["LASTFM_API_KEY"]
-        LASTFM_API_SECRET = credentials["LASTFM_API_SECRET"]
-        
-        # Initialize Spotify client
-        sp = spotipy.Spotify(client_credentials_manager=SpotifyClientCredentials(
-            client_id=SPOTIPY_CLIENT_ID, 
-            client_secret=SPOTIPY_CLIENT_SECRET
-        ))
-        
-        # Initialize Last.fm API client
-        lastfm = LastFMAPIAuth(LASTFM_API_KEY, LASTFM_API_SECRET)
-        
-        # Fetch album records based on input type
-        records = []
-        
-        jobs[job_id]['message'] = f'Fetching data from {source_type}...'
-        
-        if source_type == "album":
-            records = get_album_info(sp, source_value)
-            
-        elif source_type == "playlist":
-            records = get_playlist_info(sp, source_value)
-            
-        elif source_type == "artist":
-            records = get_artist_info(sp, source_value)
-            
-        elif source_type == "lastfm_username":
-            all_albums = []
-            
-            for source in lastfm_sources:
-                source_type = source['type']
-                period = source.get('period')
-                
-                jobs[job_id]['message'] = f'Fetching {source_type} for user {lastfm_username}...'
-                
-                lastfm_data = lastfm.get_user_albums(lastfm_username, source_type, period)
-                
-                if lastfm_data:
-                    albums = lastfm.get_albums_from_lastfm_data(lastfm_data, source_type)
-                    all_albums.extend(albums)
-            
-            # Remove duplicates
-            unique_albums = {f"{album['artist_name']} - {album['album_title']}": album for album in all_albums}
-            records = list(unique_albums.values())
-        
-        jobs[job_id]['message'] = f'Found {len(records)} albums. Checking for missing artwork...'
-        jobs[job_id]['total_albums'] = len(records)
-        
-        # Check for missing artwork
-        no_artwork_urls = []
-        
-        for i, record in enumerate(records):
-            artist_name = record['artist_name']
-            album_title = record['album_title']
-            
-            artwork_info = lastfm.check_album_artwork(artist_name, album_title)
-            
-            if not artwork_info.get('artwork_exists', False):
-                # Try to find album art URL
-                album_art_url = record.get('album_art_url')
-                
-                if not album_art_url:
-                    # Try to get album art from Spotify and iTunes
-                    album_art_url = get_album_art_url(sp, artist_name, album_title)
-                    
-                if album_art_url and artwork_info.get('lastfm_url'):
-                    no_artwork_entry = {
-                        'artist': artist_name,
-                        'album': album_title,
-                        'album_art_url': album_art_url,
-                        'lastfm_url': artwork_info.get('lastfm_url')
-                    }
-                    no_artwork_urls.append(no_artwork_entry)
-            
-            # Update progress
-            progress = int((i + 1) / len(records) * 100)
-            jobs[job_id]['progress'] = progress
-            jobs[job_id]['message'] = f'Checking artwork: {i+1}/{len(records)}'
-        
-        # Save results to JSON file
-        if no_artwork_urls:
-            artwork_folder = config_manager.config["paths"]["ARTWORK_FOLDER"]
-            json_file_path = f"{job_id}_no_artwork_albums.json"
-            
-            if not os.path.exists(artwork_folder):
-                os.makedirs(artwork_folder)
-                
-            with open(json_file_path, 'w', encoding='utf-8') as f:
-                json.dump(no_artwork_urls, f, ensure_ascii=False, indent=4)
-            
-            jobs[job_id]['missing_artwork'] = no_artwork_urls
-            jobs[job_id]['message'] = f'Found {len(no_artwork_urls)} albums missing artwork'
-        else:
-            jobs[job_id]['missing_artwork'] = []
-            jobs[job_id]['message'] = 'All albums have artwork!'
-            jobs[job_id]['status'] = 'completed'
-            return
-        
-        # Exit if check-only mode
-        if check_only:
-            jobs[job_id]['message'] = f'Check completed. Found {len(no_artwork_urls)} albums missing artwork.'
-            jobs[job_id]['status'] = 'completed'
-            return
-        
-        # Upload artwork if credentials are provided
-        if lastfm_email and lastfm_password:
-            jobs[job_id]['message'] = 'Setting up browser for uploads...'
-            
-            # Define element selectors for Last.fm
-            selectors = {
-                'username_or_email': 'id_username_or_email',
-                'password': 'id_password',
-                'post_login': 'top-artists',
-                'file_input': '//input[@type="file"]',
-                'album_title': 'title',
-                'upload_button': '.btn-primary',
-                'upload_success': '.gallery-image-uploaded-by'
-            }
-            
-            # Force headless mode for server
-            config_manager.config["settings"]["HEADLESS"] = True
-            
-            # Initialize WebDriver
-            driver = setup_webdriver()
-            
-            try:
-                # Perform login
-                jobs[job_id]['message'] = 'Logging in to Last.fm...'
-                login_success = perform_login(driver, lastfm_email, lastfm_password, selectors)
-                
-                if not login_success:
-                    jobs[job_id]['message'] = 'Login failed'
-                    jobs[job_id]['status'] = 'failed'
-                    driver.quit()
-                    return
-                
-                # Process each album for upload
-                successful_uploads = 0
-                failed_uploads = 0
-                
-                jobs[job_id]['message'] = 'Starting uploads...'
-                jobs[job_id]['progress'] = 0
-                
-                for i, album_entry in enumerate(no_artwork_urls):
-                    artist = album_entry.get('artist')
-                    album = album_entry.get('album')
-                    album_art_url = album_entry.get('album_art_url')
-                    lastfm_url = album_entry.get('lastfm_url')
-                    
-                    if not all([artist, album, album_art_url, lastfm_url]):
-                        logger.warning(f"Missing data in entry: {album_entry}")
-                        continue
-                    
-                    # Prepare upload URL
-                    upload_url = lastfm_url.rstrip('/') + '/+images/upload'
-                    
-                    # Prepare image path
-                    filename = f"{sanitize_filename(artist)} - {sanitize_filename(album)}.jpg"
-                    image_path = os.path.join(config_manager.config["paths"]["ARTWORK_FOLDER"], filename)
-                    
-                    jobs[job_id]['message'] = f'Downloading artwork for "{artist} - {album}"'
-                    
-                    # Download the album art image if it doesn't exist
-                    if not os.path.exists(image_path):
-                        success = download_image(album_art_url, image_path)
-                        if not success:
-                            logger.error(f"Failed to download image for '{album}'")
-                            failed_uploads += 1
-                            continue
-                    
-                    jobs[job_id]['message'] = f'Uploading artwork for "{artist} - {album}"'
-                    
-                    # Upload the image
-                    upload_success = perform_upload(driver, album_entry, image_path, upload_url, selectors)
-                    
-                    if upload_success:
-                        successful_uploads += 1
-                        logger.info(f"Upload successful for '{artist} - {album}'")
-                    else:
-                        failed_uploads += 1
-                        logger.error(f"Upload failed for '{artist} - {album}'")
-                    
-                    # Update progress
-                    progress = int((i + 1) / len(no_artwork_urls) * 100)
-                    jobs[job_id]['progress'] = progress
-                    
-                    # Delay between uploads to prevent rate limiting
-                    time.sleep(config_manager.config["settings"]["UPLOAD_DELAY"])
-                
-                jobs[job_id]['successful_uploads'] = successful_uploads
-                jobs[job_id]['failed_uploads'] = failed_uploads
-                jobs[job_id]['message'] = f'Upload completed. Successful: {successful_uploads}, Failed: {failed_uploads}'
-                jobs[job_id]['status'] = 'completed'
-                
-            except Exception as e:
-                logger.error(f"Error during upload process: {e}")
-                jobs[job_id]['message'] = f'Error during upload process: {str(e)}'
-                jobs[job_id]['status'] = 'failed'
-            finally:
-                # Close the WebDriver
-                driver.quit()
-                logger.info("WebDriver closed")
-        else:
-            jobs[job_id]['message'] = 'Check completed. Last.fm credentials not provided for upload.'
-            jobs[job_id]['status'] = 'completed'
-            
-    except Exception as e:
-        logger.error(f"Error in job {job_id}: {str(e)}")
-        jobs[job_id]['message'] = f'Error: {str(e)}'
-        jobs[job_id]['status'] = 'failed'
+def run_queued_job(job_id):
+    """Start processing a queued job in a background thread unless separate workers do it"""
+    if JOB_EXECUTION == 'inline':
+        thread = threading.Thread(target=inline_worker.run_once, args=(job_id,))
+        thread.daemon = True
+        thread.start()
+
+# Queues re-checks of albums still missing artwork while no other job runs
+sweep_scheduler = SweepScheduler(jobs, config_manager, BACKLOG_PATH, discard_job,
+                                 on_enqueue=run_queued_job)
+
+# With several web processes (e.g. gunicorn workers) only the one holding this
+# lock file runs the scheduler; SWEEP_SCHEDULER=0 keeps a process out entirely
+SWEEP_LOCK_PATH = config_manager.config_dir / "sweeps.lock"
+if os.environ.get('SWEEP_SCHEDULER', '1') != '0':
+    sweep_scheduler.start(SWEEP_LOCK_PATH)
+
+# Job gauges are computed at scrape time so the job loop never touches them
+JOBS.track(jobs.count)
 
 @app.route('/')
 def index():
     """Serve the main page"""
     return render_template('index.html')
 
+@app.route('/metrics')
+def metrics():
+    """Expose Prometheus metrics"""
+    return Response(render_metrics(), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
 @app.route('/api/config', methods=['GET'])
 def get_config():
     """Get current configuration"""
@@ -301,6 +99,31 @@ def update_config():
     config_manager.save_config()
     return jsonify({'status': 'success'})
 
+def import_path(import_id):
+    """Return the path of an uploaded history export, or None if there is no such import"""
+    if not import_id or secure_filename(import_id) != import_id:
+        return None
+    path = IMPORTS_DIR / import_id
+    return path if path.is_file() else None
+
+@app.route('/api/import-history', methods=['POST'])
+def import_history():
+    """Upload a Last.fm CSV export or Spotify extended streaming history JSON file"""
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'status': 'error', 'message': 'No file uploaded'}), 400
+    
+    filename = secure_filename(upload.filename)
+    if not filename.lower().endswith(HISTORY_EXTENSIONS):
+        return jsonify({'status': 'error', 'message': 'Expected a .csv or .json export'}), 400
+    
+    # Written to disk in chunks; the file is only parsed by the job
+    IMPORTS_DIR.mkdir(parents=True, exist_ok=True)
+    import_id = f"{uuid.uuid4().hex[:12]}_{filename}"
+    upload.save(str(IMPORTS_DIR / import_id))
+    
+    return jsonify({'import_id': import_id})
+
 @app.route('/api/start-job', methods=['POST'])
 def start_job():
     """Start a new job"""
@@ -314,35 +137,43 @@ def start_job():
     lastfm_username = data.get('lastfm_username')
     lastfm_sources = data.get('lastfm_sources', [])
     
-    # Generate a job ID
-    job_id = f"job_{int(time.time())}"
+    if source_type not in SOURCE_TYPES:
+        return jsonify({'status': 'error', 'message': 'Unknown source type'}), 400
     
-    # Initialize job status
-    jobs[job_id] = {
+    # History exports are referenced by import ID; workers get the file path
+    params_source_value = source_value
+    if source_type == 'history_file':
+        path = import_path(source_value)
+        if path is None:
+            return jsonify({'status': 'error', 'message': 'Unknown history import'}), 400
+        params_source_value = str(path)
+    
+    # Generate a job ID (unique across web processes sharing the queue)
+    job_id = f"job_{int(time.time())}_{uuid.uuid4().hex[:6]}"
+    
+    # Initialize job status; credentials only go into the private job params
+    jobs.enqueue({
         'id': job_id,
-        'status': 'initializing',
+        'status': 'queued',
         'progress': 0,
-        'message': 'Job created',
+        'message': 'Job queued',
         'source_type': source_type,
         'source_value': source_value,
         'check_only': check_only,
         'start_time': time.time()
-    }
-    
-    # Start processing in a background thread
-    thread = threading.Thread(
-        target=process_albums,
-        args=(job_id, source_type, source_value),
-        kwargs={
+    }, {
+        'source_type': source_type,
+        'source_value': params_source_value,
+        'options': {
             'lastfm_username': lastfm_username,
             'lastfm_sources': lastfm_sources,
             'check_only': check_only,
             'lastfm_email': lastfm_email,
             'lastfm_password': lastfm_password
         }
-    )
-    thread.daemon = True
-    thread.start()
+    })
+    
+    run_queued_job(job_id)
     
     return jsonify({'job_id': job_id})
 
@@ -361,22 +192,89 @@ def job_status(job_id):
 @app.route('/api/jobs', methods=['GET'])
 def list_jobs():
     """List all jobs"""
+    # The dashboard asks for summaries and pages through missing artwork separately
+    summary = request.args.get('summary') in ('1', 'true')
+    
     # Return a list of jobs without sensitive information
     job_list = []
-    for job_id, job in jobs.items():
+    for job in jobs.values():
         job_copy = job.copy()
         if 'lastfm_password' in job_copy:
             del job_copy['lastfm_password']
+        if summary:
+            job_copy.pop('missing_artwork', None)
         job_list.append(job_copy)
     
     return jsonify(job_list)
 
+@app.route('/api/jobs/sweeps', methods=['GET'])
+def sweep_status():
+    """Get the re-check backlog, scheduler state and recent sweep jobs"""
+    backlog = RecheckBacklog(BACKLOG_PATH)
+    try:
+        backlog_stats = backlog.stats()
+    finally:
+        backlog.close()
+    
+    sweeps = [job for job in jobs.values() if job.get('source_type') == 'sweep']
+    return jsonify({
+        'backlog': backlog_stats,
+        'scheduler': sweep_scheduler.status(),
+        'sweeps': sweeps
+    })
+
+@app.route('/api/jobs/sweeps', methods=['POST'])
+def start_sweep():
+    """Queue a sweep now instead of waiting for the scheduler"""
+    job_id = sweep_scheduler.run_once()
+    if job_id is None:
+        return jsonify({'status': 'error', 'message': 'Jobs are running or no albums are due'}), 409
+    return jsonify({'job_id': job_id})
+
+@app.route('/api/jobs/<job_id>/missing-artwork', methods=['GET'])
+def job_missing_artwork(job_id):
+    """Get one page of the albums a job found missing artwork"""
+    job = store.get(job_id)
+    if job is None:
+        return jsonify({'status': 'not_found'}), 404
+    
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    return jsonify({
+        'offset': offset,
+        'total': job.get('missing_artwork_count', 0),
+        'items': read_missing_artwork(job, offset, limit)
+    })
+
+@app.route('/api/jobs/<job_id>/trace', methods=['GET'])
+def job_trace(job_id):
+    """Export the spans recorded for a job as Chrome trace-event JSON"""
+    trace = tracing.get_trace(job_id)
+    if trace is not None:
+        chrome_trace = trace.to_chrome_trace()
+    else:
+        # Finished jobs leave their trace on disk
+        chrome_trace = tracing.load_saved_trace(job_id, TRACE_DIR)
+    if chrome_trace is None:
+        return jsonify({'status': 'not_found'}), 404
+    response = jsonify(chrome_trace)
+    response.headers['Content-Disposition'] = f'attachment; filename={job_id}_trace.json'
+    return response
+
 @app.route('/api/clear-job/<job_id>', methods=['DELETE'])
 def clear_job(job_id):
     """Clear a completed or failed job"""
     if job_id in jobs:
-        if jobs[job_id]['status'] in ['completed', 'failed']:
-            del jobs[job_id]
+        job = jobs[job_id].copy()
+        if job['status'] in ['completed', 'failed']:
+            discard_job(job)
+            # Delete the uploaded export unless another job still uses it
+            if job.get('source_type') == 'history_file':
+                path = import_path(job.get('source_value'))
+                in_use = any(other.get('source_value') == job.get('source_value')
+                             for other in jobs.values() if other.get('source_type') == 'history_file')
+                if path is not None and not in_use:
+                    path.unlink()
             return jsonify({'status': 'success'})
         else:
             return jsonify({'status': 'error', 'message': 'Cannot clear a running job'}), 400
@@ -0,0 +1,321 @@
+# benchmarks/fakes.py
+# Local stand-ins for Last.fm, the Spotify Web API, iTunes search and image hosts
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote
+
+# Smallest valid JPEG-ish payload; the pipeline never decodes images
+FAKE_IMAGE = b'\xff\xd8\xff\xe0' + b'\x00' * 2048 + b'\xff\xd9'
+
+class ServiceProfile:
+    """Latency and failure behaviour of one fake service."""
+
+    def __init__(self, latency=0.05, jitter=0.01, error_rate=0.0, throttle_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+
+class FakeLibrary:
+    """A deterministic synthetic music library.
+
+    `missing_ratio` of albums have no artwork on Last.fm; of those,
+    `spotify_ratio` can be resolved through Spotify search and the rest
+    through iTunes (except `unresolvable_ratio`, which neither knows).
+    """
+
+    def __init__(self, size, missing_ratio=0.3, spotify_ratio=0.7,
+                 unresolvable_ratio=0.1, playlist_image_ratio=0.5, seed=1):
+        rng = random.Random(seed)
+        self.albums = []
+        self.by_key = {}
+
+        for i in range(size):
+            album = {
+                'id': f'alb{i:07d}',
+                'artist': f'Artist {i // 4:06d}',
+                'title': f'Album {i:07d}',
+                'has_artwork': rng.random() >= missing_ratio,
+                'on_spotify': rng.random() < spotify_ratio,
+                'resolvable': rng.random() >= unresolvable_ratio,
+                'playlist_image': rng.random() < playlist_image_ratio
+            }
+            self.albums.append(album)
+            self.by_key[(album['artist'].lower(), album['title'].lower())] = album
+
+    def find(self, artist, title):
+        return self.by_key.get((artist.lower(), title.lower()))
+
+def service_environment(base_url):
+    """Environment variables pointing the pipeline at fakes served from `base_url`."""
+    return {
+        'LASTFM_API_URL': f'{base_url}/lastfm/2.0/',
+        'SPOTIFY_API_URL': f'{base_url}/spotify/v1/',
+        'SPOTIFY_TOKEN_URL': f'{base_url}/spotify/token',
+        'ITUNES_SEARCH_URL': f'{base_url}/itunes/search'
+    }
+
+class FakeServices:
+    """Run all fake services on one local HTTP server.
+
+    Services are routed by path prefix (`/lastfm/`, `/spotify/`, `/itunes/`,
+    `/images/`) and each has its own ServiceProfile. Requests are counted per
+    service so callers can report API calls per album.
+    """
+
+    def __init__(self, library, profiles=None, host='127.0.0.1', port=0, seed=1):
+        self.library = library
+        self.profiles = profiles or {}
+        self.counts = Counter()
+        self.counts_lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.server.block_on_close = False
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def environment(self):
+        """Environment variables pointing the pipeline at these fakes."""
+        return service_environment(self.base_url)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    # ---------------------------- Routing ---------------------------- #
+
+    def _make_handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                services._dispatch(self)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                services._dispatch(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _dispatch(self, handler):
+        url = urlparse(handler.path)
+        service = url.path.strip('/').split('/', 1)[0]
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if service == '_counts':
+            # Lets a parent process read the request counts; not counted itself
+            with self.counts_lock:
+                counts = dict(self.counts)
+            return self._send(handler, 200, counts)
+
+        with self.counts_lock:
+            self.counts[service] += 1
+            roll = self.rng.random()
+
+        profile = self.profiles.get(service, ServiceProfile())
+        delay = profile.latency + self.rng.uniform(0, profile.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if roll < profile.throttle_rate:
+            return self._send(handler, 429, {'error': 29, 'message': 'Rate limit exceeded'},
+                              headers={'Retry-After': '0'})
+        if roll < profile.throttle_rate + profile.error_rate:
+            return self._send(handler, 500, {'error': 'Internal error'})
+
+        route = {
+            'lastfm': self._lastfm,
+            'spotify': self._spotify,
+            'itunes': self._itunes,
+            'images': self._image
+        }.get(service)
+        if route is None:
+            return self._send(handler, 404, {'error': 'Not found'})
+        route(handler, url.path, params)
+
+    def _send(self, handler, status, body, content_type='application/json', headers=None):
+        payload = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def _image_url(self, album):
+        return f'{self.base_url}/images/{album["id"]}.jpg'
+
+    # ---------------------------- Last.fm ---------------------------- #
+
+    def _lastfm(self, handler, path, params):
+        method = params.get('method', '').lower()
+        limit = int(params.get('limit', 50))
+        page = int(params.get('page', 1))
+
+        if method == 'album.getinfo':
+            album = self.library.find(params.get('artist', ''), params.get('album', ''))
+            if album is None:
+                return self._send(handler, 200, {'error': 6, 'message': 'Album not found'})
+            image = self._image_url(album) if album['has_artwork'] else ''
+            return self._send(handler, 200, {'album': {
+                'name': album['title'],
+                'artist': album['artist'],
+                'url': f'https://www.last.fm/music/{quote(album["artist"])}/{quote(album["title"])}',
+                'image': [{'#text': image, 'size': size} for size in ('small', 'medium', 'large')]
+            }})
+
+        albums = self.library.albums[(page - 1) * limit:page * limit]
+        attr = {'page': str(page), 'perPage': str(limit),
+                'totalPages': str(max(1, -(-len(self.library.albums) // limit))),
+                'total': str(len(self.library.albums))}
+
+        if method == 'user.gettopalbums':
+            return self._send(handler, 200, {'topalbums': {'@attr': attr, 'album': [
+                {'name': a['title'], 'artist': {'name': a['artist']}} for a in albums
+            ]}})
+        if method in ('user.getrecenttracks', 'user.getlovedtracks'):
+            key = method.split('.get', 1)[1]
+            return self._send(handler, 200, {key: {'@attr': attr, 'track': [
+                {'name': f'Track of {a["title"]}', 'artist': {'#text': a['artist']},
+                 'album': {'#text': a['title']}} for a in albums
+            ]}})
+
+        self._send(handler, 200, {'error': 3, 'message': 'Invalid Method'})
+
+    # ---------------------------- Spotify ---------------------------- #
+
+    def _spotify_album(self, album, with_image=True):
+        images = [{'url': self._image_url(album), 'height': 640, 'width': 640}] if with_image else []
+        return {
+            'id': album['id'],
+            'name': album['title'],
+            'artists': [{'name': album['artist'], 'id': 'art' + album['id'][3:]}],
+            'images': images
+        }
+
+    def _spotify(self, handler, path, params):
+        parts = path.strip('/').split('/')[1:]
+
+        if parts == ['token']:
+            return self._send(handler, 200, {'access_token': 'fake-token', 'token_type': 'Bearer',
+                                             'expires_in': 3600})
+        if parts[:1] != ['v1']:
+            return self._send(handler, 404, {'error': {'status': 404, 'message': 'Not found'}})
+        parts = parts[1:]
+
+        if parts == ['search']:
+            album = self._match_search(params.get('q', ''))
+            items = [self._spotify_album(album)] if album and album['on_spotify'] else []
+            return self._send(handler, 200, {'albums': {'items': items, 'next': None}})
+
+        if len(parts) == 3 and parts[0] == 'playlists' and parts[2] == 'tracks':
+            limit = int(params.get('limit', 100))
+            offset = int(params.get('offset', 0))
+            albums = self.library.albums[offset:offset + limit]
+            next_url = None
+            if offset + limit < len(self.library.albums):
+                next_url = (f'{self.base_url}/spotify/v1/playlists/{parts[1]}/tracks'
+                            f'?offset={offset + limit}&limit={limit}')
+            return self._send(handler, 200, {'items': [{'track': {
+                'name': f'Track of {a["title"]}',
+                'artists': [{'name': a['artist']}],
+                'album': self._spotify_album(a, with_image=a['playlist_image'])
+            }} for a in albums], 'next': next_url})
+
+        if len(parts) == 2 and parts[0] == 'albums':
+            album = next((a for a in self.library.albums if a['id'] == parts[1]), None)
+            if album is None:
+                return self._send(handler, 404, {'error': {'status': 404, 'message': 'Not found'}})
+            return self._send(handler, 200, dict(self._spotify_album(album), tracks={'items': [
+                {'name': f'Track of {album["title"]}', 'artists': [{'name': album['artist']}]}
+            ]}))
+
+        self._send(handler, 404, {'error': {'status': 404, 'message': 'Not found'}})
+
+    def _match_search(self, query):
+        # Queries look like "artist:<name> album:<title>"
+        if 'artist:' not in query or ' album:' not in query:
+            return None
+        artist, title = query.split('artist:', 1)[1].split(' album:', 1)
+        return self.library.find(artist, title)
+
+    # ---------------------------- iTunes / images ---------------------------- #
+
+    def _itunes(self, handler, path, params):
+        term = params.get('term', '')
+        # Terms look like "<title> <artist>"; titles are fixed width in the fake library
+        title, _, artist = term.partition(' Artist ')
+        album = self.library.find('Artist ' + artist, title)
+        if album is None or not album['resolvable']:
+            return self._send(handler, 200, {'resultCount': 0, 'results': []})
+        return self._send(handler, 200, {'resultCount': 1, 'results': [{
+            'collectionName': album['title'],
+            'artistName': album['artist'],
+            'artworkUrl100': f'{self.base_url}/images/{album["id"]}/100x100bb.jpg'
+        }]})
+
+    def _image(self, handler, path, params):
+        self._send(handler, 200, FAKE_IMAGE, content_type='image/jpeg')
+
+# ---------------------------- Standalone ---------------------------- #
+
+def main(argv=None):
+    """Serve the fakes in their own process until stdin is closed.
+
+    The base URL is printed on the first line of stdout, and GET /_counts
+    returns the requests served per service.
+    """
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.fakes',
+                                     description='Serve fake music services')
+    parser.add_argument('--albums', type=int, default=200)
+    parser.add_argument('--missing-ratio', type=float, default=0.3)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    library = FakeLibrary(args.albums, missing_ratio=args.missing_ratio, seed=args.seed)
+    profile = ServiceProfile(args.latency, args.jitter, args.error_rate, args.throttle_rate)
+    with FakeServices(library, profiles={
+        'lastfm': profile, 'spotify': profile, 'itunes': profile, 'images': profile
+    }, port=args.port, seed=args.seed) as services:
+        print(services.base_url, flush=True)
+        sys.stdin.read()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+# benchmarks/run.py
+# Drive process_albums end to end against local fakes and report throughput
+#
+# Usage: python -m benchmarks.run --albums 200 --latency 0.05 --baseline benchmarks/results/<file>.json
+
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from urllib.request import urlopen
+
+from benchmarks.fakes import service_environment
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+# Metrics where a lower value is an improvement
+LOWER_IS_BETTER = ('api_calls_per_album', 'peak_rss_mb', 'wall_seconds')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark of the check pipeline')
+    parser.add_argument('--albums', type=int, default=200, help='Library size')
+    parser.add_argument('--source', choices=['playlist', 'lastfm_username'], default='playlist',
+                        help='Job source type to ingest the library through')
+    parser.add_argument('--latency', type=float, default=0.05, help='Base latency per request (s)')
+    parser.add_argument('--jitter', type=float, default=0.01, help='Random extra latency (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of HTTP 500 responses')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of HTTP 429 responses')
+    parser.add_argument('--missing-ratio', type=float, default=0.3,
+                        help='Fraction of albums without artwork on Last.fm')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rate-limit-scale', type=float, default=1.0,
+                        help='Multiply the Last.fm rate limits (e.g. 100 to measure pipeline throughput)')
+    parser.add_argument('--label', default='run', help='Name used in the results file')
+    parser.add_argument('--baseline', help='Previous results file to compare against')
+    parser.add_argument('--no-save', action='store_true', help='Do not write a results file')
+    return parser.parse_args(argv)
+
+def prepare_home(env):
+    """Point HOME at a scratch config directory so real settings are untouched."""
+    home = Path(tempfile.mkdtemp(prefix='lastfm-bench-'))
+    config_dir = home / '.lastfm_artwork_manager'
+    config_dir.mkdir()
+
+    with open(REPO_ROOT / 'config.json') as f:
+        config = json.load(f)
+    config['credentials'].update({
+        'SPOTIPY_CLIENT_ID': 'bench',
+        'SPOTIPY_CLIENT_SECRET': 'bench',
+        'LASTFM_API_KEY': 'bench',
+        'LASTFM_API_SECRET': 'bench'
+    })
+    config['paths']['ARTWORK_FOLDER'] = str(home / 'artwork')
+    with open(config_dir / 'config.json', 'w') as f:
+        json.dump(config, f)
+
+    env['HOME'] = str(home)
+    return home
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+def stage_latencies(trace):
+    """Group trace spans by name and return p50/p99 in milliseconds."""
+    durations = {}
+    for name, cat, start, end, tid, args in trace.spans:
+        durations.setdefault(name, []).append((end - start) * 1000.0)
+
+    return {name: {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'total_ms': round(sum(values), 3)
+    } for name, values in sorted(durations.items())}
+
+@contextmanager
+def fake_services(args):
+    """Serve the fakes from a child process and yield their base URL.
+
+    Running them in this process would add their memory to the peak RSS
+    and let their handler threads compete with the pipeline for the GIL.
+    """
+    command = [sys.executable, '-m', 'benchmarks.fakes',
+               '--albums', str(args.albums), '--missing-ratio', str(args.missing_ratio),
+               '--latency', str(args.latency), '--jitter', str(args.jitter),
+               '--error-rate', str(args.error_rate), '--throttle-rate', str(args.throttle_rate),
+               '--seed', str(args.seed)]
+    process = subprocess.Popen(command, cwd=REPO_ROOT, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, text=True)
+    try:
+        base_url = process.stdout.readline().strip()
+        if not base_url:
+            raise RuntimeError('Fake services failed to start')
+        yield base_url
+    finally:
+        # Closing stdin tells the child to shut down
+        process.stdin.close()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def request_counts(base_url):
+    """Requests served per fake service."""
+    with urlopen(f'{base_url}/_counts') as response:
+        return json.load(response)
+
+def run(args):
+    with fake_services(args) as base_url:
+        home = prepare_home(os.environ)
+        os.environ.update(service_environment(base_url))
+        os.environ['RATE_LIMIT_SCALE'] = str(args.rate_limit_scale)
+        os.environ.pop('JOB_QUEUE_URL', None)
+        os.chdir(home)
+        sys.path.insert(0, str(REPO_ROOT))
+
+        # Imported only now so endpoint overrides and HOME are picked up
+        import worker
+        logging.basicConfig(level=logging.WARNING)
+
+        job_id = f'bench_{int(time.time())}'
+        worker.jobs.enqueue({'id': job_id, 'status': 'queued', 'progress': 0,
+                             'message': 'Job queued', 'start_time': time.time()}, {})
+
+        if args.source == 'playlist':
+            source_value, kwargs = 'https://open.spotify.com/playlist/bench', {}
+        else:
+            source_value = 'bench'
+            kwargs = {'lastfm_username': 'bench', 'lastfm_sources': [{'type': 'topalbums'}]}
+
+        start = time.perf_counter()
+        worker.process_albums(job_id, args.source, source_value, check_only=True, **kwargs)
+        wall = time.perf_counter() - start
+
+        job = worker.jobs[job_id].copy()
+        trace = worker.tracing.get_trace(job_id)
+        counts = request_counts(base_url)
+
+    shutil.rmtree(home, ignore_errors=True)
+
+    albums = job.get('total_albums', 0)
+    api_calls = sum(count for service, count in counts.items() if service != 'images')
+    return {
+        'label': args.label,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'parameters': vars(args),
+        'status': job.get('status'),
+        'albums': albums,
+        'missing_artwork': job.get('missing_artwork_count', 0),
+        'wall_seconds': round(wall, 3),
+        'albums_per_second': round(albums / wall, 3) if wall else None,
+        'api_calls': counts,
+        'api_calls_per_album': round(api_calls / albums, 3) if albums else None,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        'stages': stage_latencies(trace) if trace else {}
+    }
+
+def compare(result, baseline):
+    """Print relative changes for the headline numbers against a baseline."""
+    print(f"\nCompared with {baseline['label']} ({baseline['timestamp']}):")
+    changed = sorted(k for k, v in baseline.get('parameters', {}).items()
+                     if k not in ('label', 'baseline', 'no_save') and result['parameters'].get(k) != v)
+    if changed:
+        print(f"  Warning: parameters differ from the baseline: {', '.join(changed)}")
+    for key in ('albums_per_second', 'api_calls_per_album', 'peak_rss_mb', 'wall_seconds'):
+        old, new = baseline.get(key), result.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100.0
+        better = change < 0 if key in LOWER_IS_BETTER else change > 0
+        verdict = 'better' if better else 'worse' if change else 'same'
+        print(f"  {key:22} {old:>10} -> {new:>10}  ({change:+.1f}%, {verdict})")
+
+def report(result):
+    print(f"Status:              {result['status']}")
+    print(f"Albums:              {result['albums']} ({result['missing_artwork']} missing artwork)")
+    print(f"Wall time:           {result['wall_seconds']} s")
+    print(f"Throughput:          {result['albums_per_second']} albums/s")
+    print(f"API calls per album: {result['api_calls_per_album']} {result['api_calls']}")
+    print(f"Peak RSS:            {result['peak_rss_mb']} MB")
+    print('\nStage latency (ms)           count      p50      p99')
+    for name, stats in result['stages'].items():
+        print(f"  {name:26} {stats['count']:>7} {stats['p50_ms']:>8.1f} {stats['p99_ms']:>8.1f}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    result = run(args)
+    report(result)
+    if baseline:
+        compare(result, baseline)
+
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{args.label}.json"
+        with open(path, 'w') as f:
+            json.dump(result, f, indent=4)
+        print(f"\nSaved results to {path}")
+
+if __name__ == '__main__':
+    main()
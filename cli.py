@@ -0,0 +1,114 @@
+# cli.py
+# Headless batch checks without the web server.
+#
+# Usage: python -m cli sources.txt > results.jsonl
+#
+# Each line of the sources file is a Spotify album/playlist/artist URL, the
+# path of a Last.fm CSV export or Spotify extended streaming history JSON file,
+# or a Last.fm username; blank lines and lines starting with '#' are ignored.
+# One JSON object per album is written to stdout as soon as it is checked.
+
+import argparse
+import json
+import logging
+import sys
+
+from lastfm_artwork_manager import ConfigManager
+from pipeline import (
+    lastfm_client, spotify_factory, upload_ledger, detect_source, fetch_records, check_record,
+    DEFAULT_LASTFM_SOURCES
+)
+
+logger = logging.getLogger('cli')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m cli',
+        description='Check albums for missing Last.fm artwork and stream JSONL results to stdout.'
+    )
+    parser.add_argument('sources', help="File with one source per line, or '-' for stdin")
+    parser.add_argument('--lastfm-sources', default=','.join(DEFAULT_LASTFM_SOURCES),
+                        help='Comma separated Last.fm sources for usernames, '
+                             'e.g. recenttracks,lovedtracks,topalbums_1month')
+    parser.add_argument('--missing-only', action='store_true',
+                        help='Only output albums that are missing artwork')
+    parser.add_argument('--no-ledger', action='store_true',
+                        help='Also check albums the upload ledger shows as recently uploaded')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log progress to stderr')
+    return parser.parse_args(argv)
+
+def read_sources(path):
+    """Yield non-empty, non-comment lines from a file or stdin."""
+    stream = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    try:
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def emit(obj):
+    sys.stdout.write(json.dumps(obj, ensure_ascii=False) + '\n')
+    sys.stdout.flush()
+
+def run(args):
+    config_manager = ConfigManager()
+    credentials = config_manager.config["credentials"]
+    lastfm = lastfm_client(credentials)
+    get_spotify = spotify_factory(credentials)
+    ledger = None if args.no_ledger else upload_ledger(config_manager)
+    lastfm_sources = [s for s in args.lastfm_sources.split(',') if s]
+
+    # Albums already checked for an earlier source in this run
+    seen = set()
+    counts = {}
+
+    for source in read_sources(args.sources):
+        try:
+            source_type, source_value = detect_source(source)
+            records = fetch_records(source_type, source_value, lastfm, get_spotify,
+                                    lastfm_sources=lastfm_sources, on_message=logger.info)
+        except Exception as e:
+            logger.error("Could not fetch %s: %s", source, e)
+            counts['source_error'] = counts.get('source_error', 0) + 1
+            emit({'source': source, 'status': 'source_error', 'error': str(e)})
+            continue
+
+        for record in records:
+            if record.key in seen:
+                continue
+            seen.add(record.key)
+
+            status = check_record(record, lastfm, get_spotify, ledger).status
+            counts[status] = counts.get(status, 0) + 1
+
+            if args.missing_only and status != 'missing':
+                continue
+            result = dict(record.to_dict(), source=source, status=status)
+            if record.error:
+                result['error'] = record.error
+            emit(result)
+
+    logger.info("Finished: %s", ', '.join(f"{k}={v}" for k, v in sorted(counts.items())))
+    return counts
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        stream=sys.stderr
+    )
+    try:
+        run(args)
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # Output was piped into something like `head`
+        return 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
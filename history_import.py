@@ -0,0 +1,166 @@
+# history_import.py
+# Stream albums out of Last.fm CSV exports and Spotify extended streaming history
+
+import csv
+import json
+import os
+import re
+
+from lastfm_artwork_manager import AlbumRecord
+
+# Bytes of text read at a time from an export
+READ_SIZE = 1 << 20
+
+# A single JSON entry larger than this means the file is not a history export
+MAX_ENTRY_SIZE = 1 << 20
+
+# Progress is reported every this many plays
+PROGRESS_EVERY = 100000
+
+HISTORY_EXTENSIONS = ('.csv', '.json')
+
+# Whitespace and separators between JSON array elements
+_SEPARATORS = re.compile(r'[\s,]*')
+
+# Header names used by the common Last.fm export tools
+CSV_ARTIST_COLUMNS = ('artist', 'artist_name', 'artist name')
+CSV_ALBUM_COLUMNS = ('album', 'album_name', 'album name')
+
+# Fields of a Spotify extended streaming history entry
+SPOTIFY_ARTIST_FIELD = 'master_metadata_album_artist_name'
+SPOTIFY_ALBUM_FIELD = 'master_metadata_album_album_name'
+
+def detect_format(path):
+    """Return 'spotify_json' or 'lastfm_csv' for an export file.
+
+    The extension decides; the content is only sniffed for other names.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        return 'spotify_json'
+    if extension == '.csv':
+        return 'lastfm_csv'
+    with open(path, encoding='utf-8-sig') as f:
+        head = f.read(4096).lstrip()
+    if head.startswith('['):
+        return 'spotify_json'
+    return 'lastfm_csv'
+
+# ---------------------------- Parsers ---------------------------- #
+
+def iter_json_array(stream, read_size=READ_SIZE):
+    """Yield the elements of a top-level JSON array one at a time.
+
+    Only the current chunk and one element are held in memory, so exports of
+    hundreds of MB are parsed in constant memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    started = False
+    eof = False
+
+    while True:
+        # Skip whitespace and separators up to the next element
+        pos = _SEPARATORS.match(buffer, pos).end()
+        if not started and pos < len(buffer):
+            if buffer[pos] != '[':
+                raise ValueError("Expected a JSON array")
+            started = True
+            pos += 1
+            continue
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+
+        if pos < len(buffer):
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                if len(buffer) - pos > MAX_ENTRY_SIZE:
+                    raise ValueError("JSON entry too large for a streaming history export")
+            else:
+                # A number cut at the chunk boundary decodes as a shorter number,
+                # so only accept an element once its delimiter has been read
+                if eof or (end < len(buffer) and buffer[end] in ' \t\r\n,]'):
+                    pos = end
+                    yield item
+                    continue
+
+        if eof:
+            if started:
+                raise ValueError("Unexpected end of JSON array")
+            return
+
+        chunk = stream.read(read_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+def iter_spotify_history(path):
+    """Yield (artist, album) for each music play in a Spotify extended history file."""
+    with open(path, encoding='utf-8-sig') as f:
+        for entry in iter_json_array(f):
+            if isinstance(entry, dict):
+                # Podcast episodes and audiobooks have no album fields
+                yield entry.get(SPOTIFY_ARTIST_FIELD), entry.get(SPOTIFY_ALBUM_FIELD)
+
+def iter_lastfm_csv(path):
+    """Yield (artist, album) for each scrobble in a Last.fm CSV export.
+
+    Files with a header row are matched by column name; headerless exports
+    are assumed to be artist, album, track, date.
+    """
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        first = next(reader, None)
+        if first is None:
+            return
+
+        columns = [column.strip().lower() for column in first]
+        artist_index = next((columns.index(c) for c in CSV_ARTIST_COLUMNS if c in columns), None)
+        album_index = next((columns.index(c) for c in CSV_ALBUM_COLUMNS if c in columns), None)
+
+        if artist_index is None or album_index is None:
+            artist_index, album_index = 0, 1
+            if len(first) > 1:
+                yield first[0], first[1]
+
+        width = max(artist_index, album_index)
+        for row in reader:
+            if len(row) > width:
+                yield row[artist_index], row[album_index]
+
+# ---------------------------- Albums ---------------------------- #
+
+def read_history_albums(path, on_message=None):
+    """Return the unique albums played in a history export as AlbumRecords.
+
+    Memory grows with the number of distinct albums, not the size of the
+    file. `on_message` is called with progress messages.
+    """
+    file_format = detect_format(path)
+    plays = iter_spotify_history(path) if file_format == 'spotify_json' else iter_lastfm_csv(path)
+    albums = {}
+    rows = 0
+
+    for rows, (artist, album) in enumerate(plays, 1):
+        if artist and album:
+            artist = artist.strip()
+            album = album.strip()
+            key = (artist.lower(), album.lower())
+            if key not in albums:
+                albums[key] = AlbumRecord(artist, album)
+        if on_message and rows % PROGRESS_EVERY == 0:
+            on_message(f"Read {rows} plays, {len(albums)} albums so far...")
+
+    if rows and not albums:
+        if file_format == 'spotify_json':
+            raise ValueError("No albums found; the basic Spotify account data export has no album "
+                             "names, so use the extended streaming history instead")
+        raise ValueError("No albums found in the CSV export")
+
+    if on_message:
+        on_message(f"Read {rows} plays from {os.path.basename(path)}: {len(albums)} albums")
+    return list(albums.values())
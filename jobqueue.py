@@ -0,0 +1,340 @@
+# jobqueue.py
+# Job registry and work queue shared by the web tier and worker processes
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlparse
+
+# A job whose worker stopped heartbeating is retried this many times in total
+MAX_ATTEMPTS = 3
+
+class JobStore:
+    """Interface for job storage backends.
+
+    A job has a public state dict (what the API returns) and private params
+    (what a worker needs to run it, including credentials). Workers claim
+    queued jobs with a lease that they must renew with heartbeat(); a job
+    whose lease expires is handed to the next worker that asks.
+    """
+
+    # True if other processes can see the jobs in this store
+    shared = False
+
+    def create(self, job, params):
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """Return a copy of the job state, or None."""
+        raise NotImplementedError
+
+    def list(self):
+        raise NotImplementedError
+
+    def update(self, job_id, fields):
+        """Merge fields into the job state."""
+        raise NotImplementedError
+
+    def delete(self, job_id):
+        raise NotImplementedError
+
+    def count(self, statuses):
+        """Count jobs whose state status is one of `statuses`."""
+        raise NotImplementedError
+
+    def claim(self, worker_id, lease_seconds, job_id=None):
+        """Lease the oldest runnable job (or only `job_id`); return (job_id, params) or None."""
+        raise NotImplementedError
+
+    def heartbeat(self, job_id, worker_id, lease_seconds):
+        """Extend a lease; return False if the worker no longer holds it."""
+        raise NotImplementedError
+
+    def finish(self, job_id, worker_id):
+        """Mark a leased job as done so it is never claimed again."""
+        raise NotImplementedError
+
+def _expired_job_fields(attempts):
+    return {
+        'status': 'failed',
+        'message': f'Job abandoned after {attempts} worker attempts'
+    }
+
+class MemoryJobStore(JobStore):
+    """In-process store; the default for a single web process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.entries = {}
+
+    def create(self, job, params):
+        with self.lock:
+            self.jobs[job['id']] = dict(job)
+            self.entries[job['id']] = {
+                'params': params, 'queue_state': 'queued', 'worker_id': None,
+                'lease_expires': None, 'attempts': 0, 'created_at': time.time()
+            }
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list(self):
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()]
+
+    def update(self, job_id, fields):
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(fields)
+
+    def delete(self, job_id):
+        with self.lock:
+            self.jobs.pop(job_id, None)
+            self.entries.pop(job_id, None)
+
+    def count(self, statuses):
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job.get('status') in statuses)
+
+    def claim(self, worker_id, lease_seconds, job_id=None):
+        now = time.time()
+        with self.lock:
+            if job_id is not None:
+                candidates = [(job_id, self.entries[job_id])] if job_id in self.entries else []
+            else:
+                candidates = sorted(self.entries.items(), key=lambda item: item[1]['created_at'])
+            for job_id, entry in candidates:
+                runnable = entry['queue_state'] == 'queued' or (
+                    entry['queue_state'] == 'leased' and entry['lease_expires'] < now)
+                if not runnable:
+                    continue
+                if entry['attempts'] >= MAX_ATTEMPTS:
+                    entry.update(queue_state='done', params={})
+                    self.jobs[job_id].update(_expired_job_fields(entry['attempts']))
+                    continue
+                entry.update(queue_state='leased', worker_id=worker_id,
+                             lease_expires=now + lease_seconds, attempts=entry['attempts'] + 1)
+                return job_id, entry['params']
+        return None
+
+    def heartbeat(self, job_id, worker_id, lease_seconds):
+        with self.lock:
+            entry = self.entries.get(job_id)
+            if not entry or entry['worker_id'] != worker_id or entry['queue_state'] != 'leased':
+                return False
+            entry['lease_expires'] = time.time() + lease_seconds
+            return True
+
+    def finish(self, job_id, worker_id):
+        with self.lock:
+            entry = self.entries.get(job_id)
+            if entry and entry['worker_id'] == worker_id:
+                entry.update(queue_state='done', params={})
+
+class SQLiteJobStore(JobStore):
+    """Store backed by a SQLite database that several processes can share.
+
+    The database must live on a local filesystem (or a volume shared by
+    containers on one host); SQLite locking is not reliable over NFS.
+    """
+
+    shared = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            status TEXT,
+            params TEXT NOT NULL DEFAULT '{}',
+            queue_state TEXT NOT NULL DEFAULT 'queued',
+            worker_id TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (queue_state, created_at);
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        """Run a block under this process's lock and an immediate write lock."""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def create(self, job, params):
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO jobs (id, state, status, params, created_at) VALUES (?, ?, ?, ?, ?)',
+                (job['id'], json.dumps(job), job.get('status'), json.dumps(params), time.time())
+            )
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute('SELECT state FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT state FROM jobs ORDER BY created_at').fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def update(self, job_id, fields):
+        with self._transaction() as conn:
+            row = conn.execute('SELECT state FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return
+            state = json.loads(row[0])
+            state.update(fields)
+            conn.execute('UPDATE jobs SET state = ?, status = ? WHERE id = ?',
+                         (json.dumps(state), state.get('status'), job_id))
+
+    def delete(self, job_id):
+        with self.lock:
+            self.conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def count(self, statuses):
+        placeholders = ','.join('?' for _ in statuses)
+        with self.lock:
+            row = self.conn.execute(
+                f'SELECT COUNT(*) FROM jobs WHERE status IN ({placeholders})', tuple(statuses)
+            ).fetchone()
+        return row[0]
+
+    def claim(self, worker_id, lease_seconds, job_id=None):
+        now = time.time()
+        only = ' AND id = ?' if job_id is not None else ''
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, params, attempts, state FROM jobs "
+                "WHERE (queue_state = 'queued' OR (queue_state = 'leased' AND lease_expires < ?))"
+                + only + " ORDER BY created_at LIMIT 20", (now,) + ((job_id,) if only else ())
+            ).fetchall()
+
+            for job_id, params, attempts, state in rows:
+                if attempts >= MAX_ATTEMPTS:
+                    state = dict(json.loads(state), **_expired_job_fields(attempts))
+                    conn.execute("UPDATE jobs SET queue_state = 'done', params = '{}', state = ?, "
+                                 "status = ? WHERE id = ?", (json.dumps(state), state['status'], job_id))
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET queue_state = 'leased', worker_id = ?, lease_expires = ?, "
+                    "attempts = attempts + 1 WHERE id = ?", (worker_id, now + lease_seconds, job_id)
+                )
+                return job_id, json.loads(params)
+        return None
+
+    def heartbeat(self, job_id, worker_id, lease_seconds):
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker_id = ? "
+                "AND queue_state = 'leased'", (time.time() + lease_seconds, job_id, worker_id)
+            )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id, worker_id):
+        # Params hold credentials, so drop them once the job can't run again
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET queue_state = 'done', params = '{}' WHERE id = ? AND worker_id = ?",
+                (job_id, worker_id)
+            )
+
+def open_store(url=None):
+    """Open a job store from a URL: 'memory://' or 'sqlite:///path/to/jobs.sqlite3'."""
+    url = url or 'memory://'
+    parsed = urlparse(url)
+
+    if parsed.scheme == 'memory':
+        return MemoryJobStore()
+    if parsed.scheme == 'sqlite':
+        # As in SQLAlchemy: sqlite:///relative/or/~/path and sqlite:////absolute/path
+        return SQLiteJobStore(os.path.expanduser(url[len('sqlite:///'):]))
+    raise ValueError(f"Unsupported job queue URL: {url}")
+
+# ---------------------------- Dict-style access ---------------------------- #
+
+class JobHandle:
+    """Dict-like view of one job that writes changes through to the store.
+
+    Reads fetch the current state from the store; prefer update() over
+    several item assignments so a shared store sees a single write.
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+
+    def _state(self):
+        state = self.store.get(self.job_id)
+        if state is None:
+            raise KeyError(self.job_id)
+        return state
+
+    def __getitem__(self, key):
+        return self._state()[key]
+
+    def __setitem__(self, key, value):
+        self.store.update(self.job_id, {key: value})
+
+    def __contains__(self, key):
+        return key in self._state()
+
+    def get(self, key, default=None):
+        return self._state().get(key, default)
+
+    def update(self, fields=None, **kwargs):
+        self.store.update(self.job_id, dict(fields or {}, **kwargs))
+
+    def copy(self):
+        return self._state()
+
+    def __repr__(self):
+        return repr(self.store.get(self.job_id))
+
+class JobRegistry:
+    """Mapping of job ID to JobHandle on top of a JobStore."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def enqueue(self, job, params):
+        self.store.create(job, params)
+        return JobHandle(self.store, job['id'])
+
+    def __getitem__(self, job_id):
+        return JobHandle(self.store, job_id)
+
+    def __contains__(self, job_id):
+        return self.store.get(job_id) is not None
+
+    def __delitem__(self, job_id):
+        self.store.delete(job_id)
+
+    def values(self):
+        return self.store.list()
+
+    def count(self, *statuses):
+        return self.store.count(statuses)
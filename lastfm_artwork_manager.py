@@ -6,6 +6,7 @@ import re
 import json
 import logging
 import shutil
+import sys
 import time
 import hashlib
 from functools import wraps, lru_cache
@@ -13,25 +14,31 @@ from urllib.parse import urlencode
 from pathlib import Path
 
 import requests
-import spotipy
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options as ChromeOptions
-from selenium.webdriver.firefox.options import Options as FirefoxOptions
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import (
-    NoSuchElementException,
-    TimeoutException,
-    WebDriverException,
-    ElementClickInterceptedException,
-    StaleElementReferenceException
-)
 from dotenv import load_dotenv
 
+from metrics import (
+    observe_api, cached_call, RATE_LIMIT_WAIT, BROWSER_STARTUP,
+    BROWSER_LOGIN, UPLOADS, UPLOAD_DURATION
+)
+from tracing import traced
+from pacing import UploadPacer
+import tracing
+
+# Selenium and spotipy are imported inside the functions that use them so that
+# check-only runs (see cli.py) do not pay for loading the browser stack.
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Service endpoints; overridable so the pipeline can run against local stand-ins
+LASTFM_API_URL = os.environ.get('LASTFM_API_URL', 'https://ws.audioscrobbler.com/2.0/')
+SPOTIFY_API_URL = os.environ.get('SPOTIFY_API_URL', 'https://api.spotify.com/v1/')
+SPOTIFY_TOKEN_URL = os.environ.get('SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
+ITUNES_SEARCH_URL = os.environ.get('ITUNES_SEARCH_URL', 'https://itunes.apple.com/search')
+
+# Multiplies every rate limit; only meant for benchmarks against the local stand-ins
+RATE_LIMIT_SCALE = float(os.environ.get('RATE_LIMIT_SCALE', '1'))
+
 # ---------------------------- Configuration ---------------------------- #
 
 class ConfigManager:
@@ -110,17 +117,20 @@ class ConfigManager:
 
 def rate_limited(max_per_second):
     """Decorator to limit function calls to a maximum rate."""
-    min_interval = 1.0 / float(max_per_second)
+    min_interval = 1.0 / (float(max_per_second) * RATE_LIMIT_SCALE)
     
     def decorator(func):
         last_time_called = [0.0]
         
         @wraps(func)
         def rate_limited_function(*args, **kwargs):
-            elapsed = time.perf_counter() - last_time_called[0]
+            now = time.perf_counter()
+            elapsed = now - last_time_called[0]
             left_to_wait = min_interval - elapsed
             if left_to_wait > 0:
                 time.sleep(left_to_wait)
+                tracing.record('rate_limit_wait', now, time.perf_counter(), function=func.__name__)
+            RATE_LIMIT_WAIT.labels(func.__name__).observe(max(left_to_wait, 0.0))
             ret = func(*args, **kwargs)
             last_time_called[0] = time.perf_counter()
             return ret
@@ -131,14 +141,51 @@ def rate_limited(max_per_second):
 
 # ---------------------------- Classes ---------------------------- #
 
+class AlbumRecord:
+    """One album as it moves through the fetch, check and upload stages.
+    
+    Large libraries produce hundreds of thousands of these, so the class uses
+    __slots__ and interns the artist and album names (an artist usually
+    appears many times).
+    """
+    __slots__ = ('artist', 'album', 'album_art_url', 'lastfm_url', 'status', 'error')
+    
+    def __init__(self, artist, album, album_art_url=None, lastfm_url=None):
+        self.artist = sys.intern(artist)
+        self.album = sys.intern(album)
+        self.album_art_url = album_art_url
+        self.lastfm_url = lastfm_url
+        # Set by the check stage: 'has_artwork', 'missing', 'unresolvable',
+        # 'error' or 'recently_uploaded'
+        self.status = None
+        self.error = None
+    
+    @property
+    def key(self):
+        """Case-insensitive identity used to deduplicate albums."""
+        return (self.artist.lower(), self.album.lower())
+    
+    def to_dict(self):
+        """Return the album as a missing artwork entry."""
+        return {
+            'artist': self.artist,
+            'album': self.album,
+            'album_art_url': self.album_art_url,
+            'lastfm_url': self.lastfm_url
+        }
+    
+    def __repr__(self):
+        return f"AlbumRecord({self.artist!r}, {self.album!r})"
+
 class LastFMAPIAuth:
     def __init__(self, api_key, api_secret):
         self.api_key = api_key
         self.api_secret = api_secret
-        self.base_url = "https://ws.audioscrobbler.com/2.0/"
+        self.base_url = LASTFM_API_URL
         logger.info("Initialized LastFMAPIAuth.")
     
     @rate_limited(4)  # Limit to 4 calls per second
+    @traced('lastfm.album.getInfo')
     def check_album_artwork(self, artist, album):
         """Check if an album has artwork on Last.fm."""
         params = {
@@ -150,8 +197,9 @@ class LastFMAPIAuth:
         }
         
         try:
-            response = requests.get(self.base_url, params=params)
-            response.raise_for_status()
+            with observe_api('lastfm'):
+                response = requests.get(self.base_url, params=params)
+                response.raise_for_status()
             data = response.json()
             
             if 'album' in data and 'image' in data['album']:
@@ -177,6 +225,7 @@ class LastFMAPIAuth:
         return hashlib.md5(sig_string.encode('utf-8')).hexdigest()
     
     @rate_limited(2)
+    @traced('lastfm.get_user_albums')
     def get_user_albums(self, username, source, period=None):
         """Fetch albums from a Last.fm user's data source."""
         params = {
@@ -199,8 +248,9 @@ class LastFMAPIAuth:
             raise ValueError("Invalid source specified.")
         
         try:
-            response = requests.get(self.base_url, params=params)
-            response.raise_for_status()
+            with observe_api('lastfm'):
+                response = requests.get(self.base_url, params=params)
+                response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
             logger.error(f"Error fetching {source} for user {username}: {e}")
@@ -221,15 +271,24 @@ class LastFMAPIAuth:
             album_name = track.get('album', {}).get('#text', track.get('name', ''))
             artist_name = track.get('artist', {}).get('#text', track.get('artist', {}).get('name', ''))
             if album_name and artist_name:
-                albums.append({
-                    'artist_name': artist_name,
-                    'album_title': album_name
-                })
+                albums.append(AlbumRecord(artist_name, album_name))
         
         return albums
 
 # ---------------------------- Helper Functions ---------------------------- #
 
+def create_spotify_client(client_id, client_secret):
+    """Create a Spotify client using the client credentials flow."""
+    import spotipy
+    from spotipy.oauth2 import SpotifyClientCredentials
+    
+    auth_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret)
+    auth_manager.OAUTH_TOKEN_URL = SPOTIFY_TOKEN_URL
+    
+    sp = spotipy.Spotify(client_credentials_manager=auth_manager)
+    sp.prefix = SPOTIFY_API_URL
+    return sp
+
 def extract_id_from_url(url, type_):
     """Extract Spotify ID from URL."""
     pattern = rf"https?://open\.spotify\.com/{type_}/([a-zA-Z0-9]+)(\?.*)?"
@@ -238,22 +297,20 @@ def extract_id_from_url(url, type_):
         raise ValueError(f"Invalid Spotify {type_.capitalize()} URL format.")
     return match.group(1)
 
+@traced('spotify.get_album_info', cat='ingest')
 def get_album_info(sp, album_url):
     """Get album information from Spotify."""
     album_id = extract_id_from_url(album_url, "album")
-    album_info = sp.album(album_id)
-    tracks = album_info['tracks']['items']
+    with observe_api('spotify'):
+        album_info = sp.album(album_id)
     
     # Extract the largest image URL available
     album_art_url = album_info['images'][0]['url'] if album_info['images'] else None
     
-    return [{
-        'track_title': track['name'],
-        'artist_name': track['artists'][0]['name'],
-        'album_title': album_info['name'],
-        'album_art_url': album_art_url
-    } for track in tracks]
+    # One record for the album rather than one per track
+    return [AlbumRecord(album_info['artists'][0]['name'], album_info['name'], album_art_url)]
 
+@traced('spotify.get_playlist_info', cat='ingest')
 def get_playlist_info(sp, playlist_url):
     """Get playlist information from Spotify."""
     playlist_id = extract_id_from_url(playlist_url, "playlist")
@@ -261,7 +318,8 @@ def get_playlist_info(sp, playlist_url):
     track_details = []
     
     # Fetch the first page of tracks
-    results = sp.playlist_tracks(playlist_id, limit=100)
+    with observe_api('spotify'), tracing.span('spotify.playlist_page', 'api'):
+        results = sp.playlist_tracks(playlist_id, limit=100)
     
     # Process tracks
     while results:
@@ -273,50 +331,48 @@ def get_playlist_info(sp, playlist_url):
             if album_id not in albums:
                 albums.add(album_id)
                 album_art_url = track['album']['images'][0]['url'] if track['album']['images'] else None
-                track_details.append({
-                    'track_title': track['name'],
-                    'artist_name': track['artists'][0]['name'],
-                    'album_title': track['album']['name'],
-                    'album_art_url': album_art_url
-                })
+                track_details.append(AlbumRecord(
+                    track['artists'][0]['name'], track['album']['name'], album_art_url
+                ))
                 
         # Check if there is a next page
         if results['next']:
-            results = sp.next(results)
+            with observe_api('spotify'), tracing.span('spotify.next_page', 'api'):
+                results = sp.next(results)
         else:
             results = None
     
     logger.info(f"Found {len(albums)} unique albums in playlist")
     return track_details
 
+@traced('spotify.get_artist_info', cat='ingest')
 def get_artist_info(sp, artist_url):
     """Get artist's albums from Spotify."""
     artist_id = extract_id_from_url(artist_url, "artist")
     albums = {}
     
     # Get artist name first
-    artist_data = sp.artist(artist_id)
+    with observe_api('spotify'):
+        artist_data = sp.artist(artist_id)
     artist_name = artist_data['name']
     
     # Process albums
-    results = sp.artist_albums(artist_id, album_type='album,single', country='US', limit=50)
+    with observe_api('spotify'), tracing.span('spotify.artist_albums_page', 'api'):
+        results = sp.artist_albums(artist_id, album_type='album,single', country='US', limit=50)
     
     while results:
         for album in results['items']:
             album_id = album['id']
             if album_id not in albums:
                 album_art_url = album['images'][0]['url'] if album['images'] else None
-                albums[album_id] = {
-                    'track_title': '',  # No track title at this level
-                    'artist_name': album['artists'][0]['name'],
-                    'album_title': album['name'],
-                    'album_art_url': album_art_url,
-                    'album_id': album_id
-                }
+                albums[album_id] = AlbumRecord(
+                    album['artists'][0]['name'], album['name'], album_art_url
+                )
                 
         # Check if there is a next page
         if results['next']:
-            results = sp.next(results)
+            with observe_api('spotify'), tracing.span('spotify.next_page', 'api'):
+                results = sp.next(results)
         else:
             results = None
     
@@ -329,12 +385,14 @@ def sanitize_filename(name):
     return re.sub(r'[\\/:"*?<>|]+', '_', name)
 
 @lru_cache(maxsize=128)
+@traced('spotify.search')
 def search_spotify_album(sp, artist_name, album_title):
     """Search for album artwork on Spotify."""
     query = f"artist:{artist_name} album:{album_title}"
     
     try:
-        result = sp.search(q=query, type='album', limit=1)
+        with observe_api('spotify'):
+            result = sp.search(q=query, type='album', limit=1)
         albums = result.get('albums', {}).get('items', [])
         if albums:
             album = albums[0]
@@ -345,6 +403,7 @@ def search_spotify_album(sp, artist_name, album_title):
         return None
 
 @lru_cache(maxsize=128)
+@traced('itunes.search')
 def search_itunes_album(album_title, artist_name):
     """Search for album artwork on iTunes."""
     query = {
@@ -352,11 +411,12 @@ def search_itunes_album(album_title, artist_name):
         'entity': 'album',
         'limit': 1,
     }
-    url = 'https://itunes.apple.com/search?' + urlencode(query)
+    url = ITUNES_SEARCH_URL + '?' + urlencode(query)
     
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
+        with observe_api('itunes'):
+            response = requests.get(url, timeout=10)
+            response.raise_for_status()
         data = response.json()
         
         if data['resultCount'] > 0:
@@ -370,29 +430,36 @@ def search_itunes_album(album_title, artist_name):
     
     return None
 
+@traced('resolve_artwork', cat='pipeline')
 def get_album_art_url(sp, artist_name, album_title):
     """Get album art URL from Spotify or iTunes."""
     # First try Spotify
-    album_art_url = search_spotify_album(sp, artist_name, album_title)
+    album_art_url = cached_call('spotify_search', search_spotify_album, sp, artist_name, album_title)
     if album_art_url:
         return album_art_url
     
     # Try iTunes if Spotify fails
-    return search_itunes_album(album_title, artist_name)
+    return cached_call('itunes_search', search_itunes_album, album_title, artist_name)
+
+def default_pacer():
+    """Return a pacer using the settings in the config file, for callers without one."""
+    return UploadPacer.from_settings(ConfigManager().config.get("settings"))
 
-def download_image(url, save_path):
+@traced('download_image', cat='pipeline')
+def download_image(url, save_path, pacer=None):
     """Download an image from a URL with retry logic."""
-    max_retries = 3
-    retry_delay = 5
+    pacer = pacer or default_pacer()
+    max_retries = pacer.max_retries
     
     for attempt in range(max_retries):
         try:
-            response = requests.get(url, stream=True, timeout=10)
-            response.raise_for_status()
-            
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(1024):
-                    f.write(chunk)
+            with observe_api('image_download'):
+                response = requests.get(url, stream=True, timeout=10)
+                response.raise_for_status()
+                
+                with open(save_path, 'wb') as f:
+                    for chunk in response.iter_content(1024):
+                        f.write(chunk)
             
             logger.info(f"Downloaded image to {save_path}")
             return True
@@ -400,13 +467,24 @@ def download_image(url, save_path):
         except requests.RequestException as e:
             logger.warning(f"Attempt {attempt+1} - Failed to download image: {e}")
             if attempt < max_retries - 1:
-                time.sleep(retry_delay)
+                pacer.backoff(attempt)
     
     logger.error(f"Failed to download image from {url} after {max_retries} attempts")
     return False
 
+@traced('browser_startup', cat='browser')
 def setup_webdriver():
     """Set up the Selenium WebDriver."""
+    with BROWSER_STARTUP.time():
+        return _start_webdriver()
+
+def _start_webdriver():
+    """Start Firefox, falling back to Chrome if Firefox is unavailable."""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options as ChromeOptions
+    from selenium.webdriver.firefox.options import Options as FirefoxOptions
+    from selenium.common.exceptions import WebDriverException
+    
     # Always use Firefox for headless server operation
     options = FirefoxOptions()
     options.add_argument('--headless')
@@ -436,18 +514,24 @@ def setup_webdriver():
             logger.error(f"Error initializing Chrome WebDriver: {chrome_e}")
             raise
 
-def perform_login(driver, email, password, selectors):
+@traced('login', cat='browser')
+def perform_login(driver, email, password, selectors, pacer=None):
     """Log in to Last.fm with retry logic."""
-    max_retries = 3
-    retry_delay = 5
-    wait_time = 10
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import NoSuchElementException, TimeoutException
+    
+    pacer = pacer or default_pacer()
+    max_retries = pacer.max_retries
+    start = time.perf_counter()
     
     for attempt in range(max_retries):
         try:
             driver.get("https://www.last.fm/login")
             logger.info("Navigated to Last.fm login page")
             
-            wait = WebDriverWait(driver, wait_time)
+            wait = WebDriverWait(driver, pacer.wait_time)
             
             # Enter email
             username_field = wait.until(
@@ -475,29 +559,50 @@ def perform_login(driver, email, password, selectors):
             )
             
             logger.info("Login successful")
+            BROWSER_LOGIN.labels('success').observe(time.perf_counter() - start)
             return True
             
         except (TimeoutException, NoSuchElementException, Exception) as e:
             logger.warning(f"Attempt {attempt+1} - Login error: {e}")
+            if isinstance(e, TimeoutException):
+                pacer.widen_wait()
             
             if attempt < max_retries - 1:
-                logger.info(f"Retrying login in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                delay = pacer.backoff_delay(attempt)
+                logger.info(f"Retrying login in {delay:.1f} seconds...")
+                pacer.backoff(attempt, delay)
     
     logger.error("Login failed after maximum retries")
+    BROWSER_LOGIN.labels('failure').observe(time.perf_counter() - start)
     return False
 
-def perform_upload(driver, album_entry, image_path, upload_url, selectors):
-    """Upload album artwork to Last.fm with retry logic."""
-    max_retries = 3
-    retry_delay = 5
-    wait_time = 10
+@traced('upload', cat='browser')
+def perform_upload(driver, album_entry, image_path, upload_url, selectors, pacer=None):
+    """Upload album artwork to Last.fm with retry logic.
+    
+    Each attempt's round-trip time and outcome is reported to `pacer`, which
+    also supplies the page timeout and the delay between retries.
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import (
+        NoSuchElementException,
+        TimeoutException,
+        ElementClickInterceptedException,
+        StaleElementReferenceException
+    )
+    
+    pacer = pacer or default_pacer()
+    max_retries = pacer.max_retries
+    start = time.perf_counter()
     
     for attempt in range(max_retries):
+        attempt_start = time.perf_counter()
         try:
             driver.get(upload_url)
             
-            wait = WebDriverWait(driver, wait_time)
+            wait = WebDriverWait(driver, pacer.wait_time)
             
             # Upload image file
             file_input = wait.until(
@@ -510,7 +615,7 @@ def perform_upload(driver, album_entry, image_path, upload_url, selectors):
                 EC.presence_of_element_located((By.NAME, selectors['album_title']))
             )
             title_input.clear()
-            title_input.send_keys(album_entry['album'])
+            title_input.send_keys(album_entry.album)
             
             # Click upload button
             upload_button = wait.until(
@@ -523,16 +628,23 @@ def perform_upload(driver, album_entry, image_path, upload_url, selectors):
                 EC.presence_of_element_located((By.CSS_SELECTOR, selectors['upload_success']))
             )
             
-            logger.info(f"Successfully uploaded image for '{album_entry['album']}' by '{album_entry['artist']}'")
+            pacer.record_success(time.perf_counter() - attempt_start)
+            logger.info(f"Successfully uploaded image for '{album_entry.album}' by '{album_entry.artist}'")
+            UPLOADS.labels('success').inc()
+            UPLOAD_DURATION.labels('success').observe(time.perf_counter() - start)
             return True
             
         except (TimeoutException, NoSuchElementException, 
                 ElementClickInterceptedException, StaleElementReferenceException, Exception) as e:
             logger.warning(f"Attempt {attempt+1} - Upload error: {e}")
+            pacer.record_failure(timed_out=isinstance(e, TimeoutException))
             
             if attempt < max_retries - 1:
-                logger.info(f"Retrying upload in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                delay = pacer.backoff_delay(attempt)
+                logger.info(f"Retrying upload in {delay:.1f} seconds...")
+                pacer.backoff(attempt, delay)
     
-    logger.error(f"Upload failed for '{album_entry['album']}' after maximum retries")
+    logger.error(f"Upload failed for '{album_entry.album}' after maximum retries")
+    UPLOADS.labels('failure').inc()
+    UPLOAD_DURATION.labels('failure').observe(time.perf_counter() - start)
     return False
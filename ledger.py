@@ -0,0 +1,152 @@
+# ledger.py
+# Persistent record of artwork upload attempts, shared by all jobs and processes
+
+import hashlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Albums uploaded within this many days are skipped unless the config overrides it
+DEFAULT_RECENT_DAYS = 7
+
+# A claim on an album expires after this long if its upload is never recorded
+PENDING_SECONDS = 30 * 60
+
+def file_sha256(path):
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class UploadLedger:
+    """Upload attempts and outcomes keyed by album identity and image hash.
+
+    Last.fm takes a while to show newly uploaded artwork, so an album that
+    was uploaded recently still looks like it is missing artwork. Jobs ask
+    the ledger before checking or uploading so such albums are skipped
+    without any API or browser work, and an image that was already accepted
+    for an album is never uploaded again.
+
+    Before downloading, a job claims the album with a pending row (stored
+    with an empty image hash), so two jobs never upload the same album at
+    once; record() or release() removes the claim.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS uploads (
+            artist TEXT NOT NULL,
+            album TEXT NOT NULL,
+            image_hash TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_attempt REAL NOT NULL,
+            last_success REAL,
+            PRIMARY KEY (artist, album, image_hash)
+        );
+        CREATE INDEX IF NOT EXISTS uploads_success ON uploads (artist, album, last_success);
+    """
+
+    def __init__(self, path, recent_seconds=DEFAULT_RECENT_DAYS * 86400):
+        self.path = str(path)
+        self.recent_seconds = recent_seconds
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        """Run a block under this object's lock and an immediate write lock."""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def claim(self, key):
+        """Reserve an album for upload.
+
+        Returns False, without claiming, if the album was uploaded within the
+        window or another job holds a claim younger than PENDING_SECONDS.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            busy = conn.execute(
+                "SELECT 1 FROM uploads WHERE artist = ? AND album = ? AND (last_success >= ? "
+                "OR (outcome = 'pending' AND last_attempt >= ?)) LIMIT 1",
+                (key[0], key[1], now - self.recent_seconds, now - PENDING_SECONDS)
+            ).fetchone()
+            if busy is not None:
+                return False
+            conn.execute(
+                '''INSERT INTO uploads (artist, album, image_hash, outcome, last_attempt)
+                   VALUES (?, ?, '', 'pending', ?)
+                   ON CONFLICT (artist, album, image_hash) DO UPDATE SET
+                       outcome = excluded.outcome,
+                       last_attempt = excluded.last_attempt''',
+                (key[0], key[1], now)
+            )
+        return True
+
+    def release(self, key):
+        """Drop the claim on an album that was not uploaded after all."""
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM uploads WHERE artist = ? AND album = ? AND image_hash = ''",
+                (key[0], key[1])
+            )
+
+    def record(self, key, image_hash, success):
+        """Record one upload attempt for an album key (artist, album) and drop its claim."""
+        now = time.time()
+        outcome = 'success' if success else 'failure'
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM uploads WHERE artist = ? AND album = ? AND image_hash = ''",
+                (key[0], key[1])
+            )
+            conn.execute(
+                '''INSERT INTO uploads (artist, album, image_hash, outcome, attempts,
+                                        last_attempt, last_success)
+                   VALUES (?, ?, ?, ?, 1, ?, ?)
+                   ON CONFLICT (artist, album, image_hash) DO UPDATE SET
+                       outcome = excluded.outcome,
+                       attempts = attempts + 1,
+                       last_attempt = excluded.last_attempt,
+                       last_success = COALESCE(excluded.last_success, last_success)''',
+                (key[0], key[1], image_hash, outcome, now, now if success else None)
+            )
+
+    def recently_uploaded(self, key):
+        """Return True if any image was uploaded for the album within the window."""
+        cutoff = time.time() - self.recent_seconds
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT 1 FROM uploads WHERE artist = ? AND album = ? AND last_success >= ? LIMIT 1',
+                (key[0], key[1], cutoff)
+            ).fetchone()
+        return row is not None
+
+    def image_uploaded(self, key, image_hash):
+        """Return True if this exact image was ever uploaded for the album."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT 1 FROM uploads WHERE artist = ? AND album = ? AND image_hash = ? '
+                'AND last_success IS NOT NULL',
+                (key[0], key[1], image_hash)
+            ).fetchone()
+        return row is not None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
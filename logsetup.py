@@ -0,0 +1,275 @@
+# logsetup.py
+# Queue-based JSON logging so job threads never wait on log I/O
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import socket
+import threading
+import time
+from pathlib import Path
+
+from proclock import acquire_process_lock
+
+# Used when the config has no paths.LOG_FILE
+DEFAULT_LOG_FILE = 'lastfm_artwork_manager.log'
+
+# Rotate the log file at this size, keeping this many old files
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# Per-process log files unused for this long are deleted
+LOG_RETENTION_DAYS = 14
+
+# Records waiting for the writer thread; further records are dropped
+LOG_QUEUE_SIZE = 10000
+
+# Per call site: records passed each second before sampling starts, and the
+# fraction of records kept after that (1 in LOG_SAMPLE_EVERY)
+LOG_SAMPLE_BURST = 20
+LOG_SAMPLE_EVERY = 50
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(job_context)s%(message)s'
+
+_local = threading.local()
+
+_listener = None
+
+# Lock on this process's log slot, held until exit
+_slot_lock = None
+
+# ---------------------------- Context ---------------------------- #
+
+def current_context():
+    """Return the log fields set for the current thread."""
+    return getattr(_local, 'fields', {})
+
+class log_context:
+    """Attach fields such as job_id and stage to log records from this thread."""
+
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def __enter__(self):
+        self.previous = current_context()
+        _local.fields = dict(self.previous, **self.fields)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.fields = self.previous
+        return False
+
+def set_stage(stage):
+    """Set the stage reported by this thread's log records (within a log_context)."""
+    _local.fields = dict(current_context(), stage=stage)
+
+class ContextFilter(logging.Filter):
+    """Copy the calling thread's context onto the record before it is queued."""
+
+    def filter(self, record):
+        fields = current_context()
+        record.job_id = fields.get('job_id')
+        record.stage = fields.get('stage')
+        record.job_context = f"[{record.job_id}:{record.stage}] " if record.job_id else ''
+        return True
+
+# ---------------------------- Sampling ---------------------------- #
+
+class SamplingFilter(logging.Filter):
+    """Thin out bursts of records from the same call site.
+
+    Per-album messages come from a handful of log statements, so records are
+    grouped by logger and line number. Each site passes LOG_SAMPLE_BURST
+    records per second; beyond that only one in LOG_SAMPLE_EVERY is kept and
+    carries the number of records skipped since the last one kept. Errors
+    are never sampled.
+    """
+
+    def __init__(self, burst=LOG_SAMPLE_BURST, every=LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.burst = burst
+        self.every = every
+        self.lock = threading.Lock()
+        # (logger, line) -> [window start, records in window, skipped]
+        self.sites = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+
+        key = (record.name, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or now - site[0] >= 1.0:
+                skipped = site[2] if site is not None else 0
+                site = self.sites[key] = [now, 0, 0]
+                if skipped:
+                    record.sampled = skipped
+            site[1] += 1
+            if site[1] <= self.burst or (site[1] - self.burst) % self.every == 0:
+                if site[2]:
+                    record.sampled = site[2]
+                    site[2] = 0
+                return True
+            site[2] += 1
+            return False
+
+# ---------------------------- Handlers ---------------------------- #
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+                  + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'job_id': getattr(record, 'job_id', None),
+            'stage': getattr(record, 'stage', None),
+            'thread': record.threadName,
+            'process': record.processName
+        }
+        if getattr(record, 'sampled', None):
+            entry['sampled'] = record.sampled
+        if getattr(record, 'dropped', None):
+            entry['dropped'] = record.dropped
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.unreported = 0
+
+    def prepare(self, record):
+        # Keep the exception text but let the writer thread do the formatting
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # The first record that fits after an overflow reports what was lost
+        if self.unreported:
+            record.dropped = self.unreported
+        try:
+            self.queue.put_nowait(record)
+            self.unreported = 0
+        except queue.Full:
+            self.dropped += 1
+            self.unreported += 1
+
+def log_file_path(config_manager, suffix=None):
+    """Resolve paths.LOG_FILE against the config directory, adding `suffix` before the extension."""
+    path = config_manager.config_dir / config_manager.config.get("paths", {}).get("LOG_FILE", DEFAULT_LOG_FILE)
+    if suffix:
+        path = path.with_name(f"{path.stem}.{suffix}{path.suffix}")
+    return path
+
+def process_log_file(config_manager, role):
+    """Return a log file of this process's own, `<name>.<role>-<host>-<slot>.log`.
+
+    Size based rotation is not safe with several processes writing one
+    file, so each process takes the lowest slot whose lock no running
+    process holds. A restarted process reuses its slot's files instead of
+    adding new ones, and slots unused for LOG_RETENTION_DAYS (e.g. those
+    of containers that no longer exist) are deleted.
+    """
+    global _slot_lock
+    _remove_stale_logs(log_file_path(config_manager))
+
+    prefix = f"{role}-{socket.gethostname()}"
+    slot = 0
+    while True:
+        path = log_file_path(config_manager, f"{prefix}-{slot}")
+        lock = acquire_process_lock(f"{path}.lock")
+        if lock is not None:
+            _slot_lock = lock
+            return path
+        slot += 1
+
+def _remove_stale_logs(base):
+    """Delete the files of per-process log slots that are unlocked and unused."""
+    cutoff = time.time() - LOG_RETENTION_DAYS * 86400
+    for lock_path in base.parent.glob(f"{base.stem}.*{base.suffix}.lock"):
+        log_path = lock_path.with_suffix('')
+        files = [path for path in base.parent.glob(f"{log_path.name}*") if path != lock_path]
+        try:
+            # The lock file is rewritten whenever a process takes the slot
+            if any(path.stat().st_mtime >= cutoff for path in files + [lock_path]):
+                continue
+        except OSError:
+            continue
+        lock = acquire_process_lock(lock_path)
+        if lock is None:
+            continue
+        for path in files + [lock_path]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        if lock is not True:
+            lock.close()
+
+def setup_logging(log_file=None, level=logging.INFO, console=True,
+                  max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """Route all logging through a queue to a background writer thread.
+
+    Records are written as JSON lines to `log_file` (rotated by size) and as
+    text to stderr if `console` is set. Calling this again replaces the
+    previous setup.
+    """
+    global _listener
+
+    handlers = []
+    if log_file:
+        Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    if console:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(stream_handler)
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    if _listener is not None:
+        _listener.stop()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return queue_handler
+
+def stop_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
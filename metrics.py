@@ -0,0 +1,174 @@
+# metrics.py
+# Prometheus metrics shared by the Flask app and the core pipeline
+
+import atexit
+import os
+import socket
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, values
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# With several web or worker processes, set PROMETHEUS_MULTIPROC_DIR to a
+# directory shared by all of them (and emptied when they are all restarted)
+# so /metrics reports the sum over every process instead of one process
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+def process_identifier(pid=None):
+    """Name of a process's metric files; containers on one host can share PIDs."""
+    return f"{socket.gethostname().replace('_', '-')}-{pid or os.getpid()}"
+
+if MULTIPROC_DIR:
+    # Must be in place before the metrics below are created
+    values.ValueClass = values.MultiProcessValue(process_identifier)
+
+# Buckets tuned for HTTP round trips (tens of ms up to the 10s request timeout)
+API_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Buckets for browser work, which is measured in seconds rather than ms
+BROWSER_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+# ---------------------------- Outbound APIs ---------------------------- #
+
+API_REQUESTS = Counter(
+    'lastfm_artwork_api_requests_total',
+    'Outbound API requests by API and outcome.',
+    ['api', 'outcome']
+)
+
+API_LATENCY = Histogram(
+    'lastfm_artwork_api_request_duration_seconds',
+    'Outbound API request latency.',
+    ['api'],
+    buckets=API_BUCKETS
+)
+
+RATE_LIMIT_WAIT = Histogram(
+    'lastfm_artwork_rate_limit_wait_seconds',
+    'Time spent sleeping in the rate limiter before a call.',
+    ['function'],
+    buckets=(0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0)
+)
+
+CACHE_REQUESTS = Counter(
+    'lastfm_artwork_cache_requests_total',
+    'Lookups against in-process caches by result (hit or miss).',
+    ['cache', 'result']
+)
+
+# ---------------------------- Browser / uploads ---------------------------- #
+
+BROWSER_STARTUP = Histogram(
+    'lastfm_artwork_browser_startup_seconds',
+    'Time taken to start a WebDriver session.',
+    buckets=BROWSER_BUCKETS
+)
+
+BROWSER_LOGIN = Histogram(
+    'lastfm_artwork_browser_login_seconds',
+    'Time taken to log in to Last.fm, including retries.',
+    ['outcome'],
+    buckets=BROWSER_BUCKETS
+)
+
+UPLOADS = Counter(
+    'lastfm_artwork_uploads_total',
+    'Artwork uploads by outcome.',
+    ['outcome']
+)
+
+UPLOAD_DURATION = Histogram(
+    'lastfm_artwork_upload_duration_seconds',
+    'Time taken to upload one album artwork, including retries.',
+    ['outcome'],
+    buckets=BROWSER_BUCKETS
+)
+
+UPLOAD_GAP = Gauge(
+    'lastfm_artwork_upload_gap_seconds',
+    'Current adaptive delay between uploads (the largest across running processes).',
+    multiprocess_mode='livemax'
+)
+
+# ---------------------------- Jobs ---------------------------- #
+
+class JobCollector:
+    """Reports job counts by state, read from the job store at scrape time."""
+
+    def __init__(self):
+        self.count = None
+
+    def track(self, count):
+        """Use `count(state)` (e.g. JobRegistry.count) for the job gauge."""
+        self.count = count
+
+    def collect(self):
+        family = GaugeMetricFamily('lastfm_artwork_jobs', 'Jobs in the job store by state.',
+                                   labels=['state'])
+        if self.count is not None:
+            for state in ('queued', 'running'):
+                family.add_metric([state], self.count(state))
+        yield family
+
+JOBS = JobCollector()
+REGISTRY.register(JOBS)
+
+# ---------------------------- Helpers ---------------------------- #
+
+@contextmanager
+def observe_api(api):
+    """Count and time one outbound API call.
+
+    The outcome is 'throttled' if the block raises on an HTTP 429, 'error'
+    for any other exception, and otherwise whatever the caller stored in the
+    yielded dict (default 'success').
+    """
+    result = {'outcome': 'success'}
+    start = time.perf_counter()
+    try:
+        yield result
+    except Exception as e:
+        result['outcome'] = 'throttled' if _http_status(e) == 429 else 'error'
+        raise
+    finally:
+        API_LATENCY.labels(api).observe(time.perf_counter() - start)
+        API_REQUESTS.labels(api, result['outcome']).inc()
+
+def _http_status(error):
+    """Return the HTTP status carried by a requests or spotipy exception."""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return getattr(response, 'status_code', None)
+    return getattr(error, 'http_status', None)
+
+def render_metrics():
+    """Return the metrics of this process, or of all processes in multiprocess mode."""
+    if not MULTIPROC_DIR:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(JOBS)
+    return generate_latest(registry)
+
+def mark_process_dead(pid=None):
+    """Drop the live gauges of a process that has exited."""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(process_identifier(pid), MULTIPROC_DIR)
+
+if MULTIPROC_DIR:
+    atexit.register(mark_process_dead)
+
+def cached_call(cache_name, func, *args):
+    """Call an lru_cache wrapped function and record whether it was a hit.
+
+    The hit count is compared before and after the call; concurrent callers
+    can occasionally misattribute a lookup, which is acceptable for a ratio.
+    """
+    hits_before = func.cache_info().hits
+    value = func(*args)
+    result = 'hit' if func.cache_info().hits > hits_before else 'miss'
+    CACHE_REQUESTS.labels(cache_name, result).inc()
+    return value
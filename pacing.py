@@ -0,0 +1,133 @@
+# pacing.py
+# Adaptive pacing and retry backoff for the browser upload path
+
+import random
+import time
+
+import tracing
+from metrics import UPLOAD_GAP
+
+# Defaults matching the shipped config.json
+DEFAULT_SETTINGS = {
+    'UPLOAD_DELAY': 8,
+    'WAIT_TIME': 5,
+    'MAX_RETRIES': 3,
+    'RETRY_DELAY': 5
+}
+
+# Multiplier applied to the gap after each clean upload
+SUCCESS_DECAY = 0.8
+
+# Multiplier applied to the gap when the site pushes back
+FAILURE_GROWTH = 2.0
+
+# Smoothing factors for the round-trip estimate (as in TCP's RTO calculation)
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+
+class UploadPacer:
+    """Decides how long to wait between uploads and before retries.
+
+    The gap between uploads starts at UPLOAD_DELAY, shrinks towards a floor
+    while uploads succeed at a steady round-trip time and doubles (up to
+    UPLOAD_DELAY * 2**MAX_RETRIES) when an upload fails or the site slows
+    down. Retries back off exponentially from RETRY_DELAY with jitter, and
+    page timeouts follow the measured round-trip time between WAIT_TIME and
+    four times WAIT_TIME. MAX_RETRIES bounds the attempts per operation.
+
+    Only a pacer created with `report_gap` updates the upload gap gauge, so
+    stand-in pacers never overwrite the value of the job that is uploading.
+    """
+
+    def __init__(self, upload_delay=8, wait_time=5, max_retries=3, retry_delay=5, report_gap=False):
+        self.max_retries = max(1, int(max_retries))
+        self.retry_delay = max(0.0, float(retry_delay))
+
+        upload_delay = max(0.0, float(upload_delay))
+        self.min_gap = upload_delay / 4
+        self.max_gap = upload_delay * 2 ** self.max_retries
+        self.gap = upload_delay
+
+        self.min_wait = max(1.0, float(wait_time))
+        self.max_wait = self.min_wait * 4
+        self.wait_time = self.min_wait * 2
+
+        self.srtt = None
+        self.rttvar = 0.0
+        self.last_finished = None
+        self.report_gap = report_gap
+        if report_gap:
+            UPLOAD_GAP.set(self.gap)
+
+    @classmethod
+    def from_settings(cls, settings, report_gap=False):
+        """Create a pacer from the 'settings' section of the config."""
+        settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        return cls(
+            upload_delay=settings['UPLOAD_DELAY'],
+            wait_time=settings['WAIT_TIME'],
+            max_retries=settings['MAX_RETRIES'],
+            retry_delay=settings['RETRY_DELAY'],
+            report_gap=report_gap
+        )
+
+    # ---------------------------- Observations ---------------------------- #
+
+    def record_success(self, rtt):
+        """Record an operation that succeeded after `rtt` seconds."""
+        slow = self.srtt is not None and rtt > self.srtt + 2 * self.rttvar
+        self._update_rtt(rtt)
+        if not slow:
+            self._set_gap(self.gap * SUCCESS_DECAY)
+        self.last_finished = time.monotonic()
+
+    def record_failure(self, timed_out=False):
+        """Record a failed attempt; timeouts also widen the page timeout."""
+        self._set_gap(self.gap * FAILURE_GROWTH)
+        if timed_out:
+            self.widen_wait()
+        self.last_finished = time.monotonic()
+
+    def widen_wait(self):
+        """Give slow pages more time after a timeout."""
+        self.wait_time = min(self.wait_time * 1.5, self.max_wait)
+
+    def _update_rtt(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += RTT_BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += RTT_ALPHA * (rtt - self.srtt)
+        self.wait_time = min(max(self.srtt + 4 * self.rttvar, self.min_wait), self.max_wait)
+
+    def _set_gap(self, gap):
+        self.gap = min(max(gap, self.min_gap), self.max_gap)
+        if self.report_gap:
+            UPLOAD_GAP.set(self.gap)
+
+    # ---------------------------- Waiting ---------------------------- #
+
+    def backoff_delay(self, attempt):
+        """Delay before retry number `attempt` (0-based): exponential with jitter."""
+        ceiling = self.retry_delay * 2 ** attempt
+        return random.uniform(ceiling / 2, ceiling)
+
+    def backoff(self, attempt, delay=None):
+        """Sleep before retrying and return the delay used."""
+        if delay is None:
+            delay = self.backoff_delay(attempt)
+        with tracing.span('retry_backoff', attempt=attempt + 1):
+            time.sleep(delay)
+        return delay
+
+    def wait_for_next(self):
+        """Sleep until the current gap has passed since the last upload finished."""
+        if self.last_finished is None:
+            return 0.0
+        remaining = self.gap - (time.monotonic() - self.last_finished)
+        if remaining <= 0:
+            return 0.0
+        with tracing.span('upload_delay', gap=round(self.gap, 2)):
+            time.sleep(remaining)
+        return remaining
@@ -0,0 +1,161 @@
+# pipeline.py
+# Fetch and check/resolve stages shared by the web app and the batch CLI.
+# Nothing here imports Flask, Selenium or spotipy at module level.
+
+import os
+import re
+import logging
+
+import tracing
+from ledger import UploadLedger, DEFAULT_RECENT_DAYS
+from history_import import read_history_albums, HISTORY_EXTENSIONS
+from lastfm_artwork_manager import (
+    LastFMAPIAuth, get_album_info, get_playlist_info, get_artist_info,
+    get_album_art_url, create_spotify_client
+)
+
+logger = logging.getLogger(__name__)
+
+SPOTIFY_SOURCES = ('album', 'playlist', 'artist')
+
+# Source types a job can be started with (sweeps are queued internally)
+SOURCE_TYPES = SPOTIFY_SOURCES + ('lastfm_username', 'history_file')
+
+# Last.fm sources used when a username is given without explicit sources
+DEFAULT_LASTFM_SOURCES = ['topalbums']
+
+SPOTIFY_URL_PATTERN = re.compile(r"https?://open\.spotify\.com/(album|playlist|artist)/")
+
+# ---------------------------- Clients ---------------------------- #
+
+def lastfm_client(credentials):
+    """Create a Last.fm API client from the credentials section of the config."""
+    return LastFMAPIAuth(credentials["LASTFM_API_KEY"], credentials["LASTFM_API_SECRET"])
+
+def spotify_factory(credentials):
+    """Return a callable that creates the Spotify client on first use.
+
+    Check runs over Last.fm sources often never need Spotify, so spotipy is
+    only imported and authenticated when a stage actually asks for it.
+    """
+    client = []
+
+    def get_spotify():
+        if not client:
+            client.append(create_spotify_client(
+                credentials["SPOTIPY_CLIENT_ID"], credentials["SPOTIPY_CLIENT_SECRET"]
+            ))
+        return client[0]
+
+    return get_spotify
+
+def upload_ledger(config_manager):
+    """Open the upload ledger in the config directory.
+
+    UPLOAD_LEDGER_DAYS in the settings controls how long an uploaded album
+    is skipped.
+    """
+    days = config_manager.config.get("settings", {}).get("UPLOAD_LEDGER_DAYS", DEFAULT_RECENT_DAYS)
+    return UploadLedger(config_manager.config_dir / "uploads.sqlite3", recent_seconds=days * 86400)
+
+# ---------------------------- Sources ---------------------------- #
+
+def parse_lastfm_source(source):
+    """Normalize a Last.fm source into a {'type', 'period'} dict.
+
+    Accepts either a dict or the strings sent by the web UI, such as
+    'recenttracks' or 'topalbums_7day'.
+    """
+    if isinstance(source, dict):
+        return {'type': source['type'], 'period': source.get('period')}
+
+    source_type, _, period = source.partition('_')
+    return {'type': source_type, 'period': period or None}
+
+def detect_source(value):
+    """Work out the job source type for a Spotify URL, history export or Last.fm username."""
+    value = value.strip()
+    match = SPOTIFY_URL_PATTERN.match(value)
+    if match:
+        return match.group(1), value
+    if value.startswith(('http://', 'https://')):
+        raise ValueError(f"Unsupported source URL: {value}")
+    if value.lower().endswith(HISTORY_EXTENSIONS) and os.path.isfile(value):
+        return 'history_file', value
+    return 'lastfm_username', value
+
+def fetch_records(source_type, source_value, lastfm, get_spotify,
+                  lastfm_username=None, lastfm_sources=None, on_message=None):
+    """Fetch the album records for a job source.
+
+    `on_message` is called with human readable progress messages.
+    """
+    if source_type == "album":
+        return get_album_info(get_spotify(), source_value)
+
+    if source_type == "playlist":
+        return get_playlist_info(get_spotify(), source_value)
+
+    if source_type == "artist":
+        return get_artist_info(get_spotify(), source_value)
+
+    if source_type == "history_file":
+        # Last.fm CSV or Spotify extended streaming history, read from disk
+        with tracing.span('read_history_file', 'pipeline'):
+            return read_history_albums(source_value, on_message=on_message)
+
+    if source_type == "lastfm_username":
+        username = lastfm_username or source_value
+        unique_albums = {}
+
+        for source in lastfm_sources or DEFAULT_LASTFM_SOURCES:
+            source = parse_lastfm_source(source)
+
+            if on_message:
+                on_message(f"Fetching {source['type']} for user {username}...")
+
+            lastfm_data = lastfm.get_user_albums(username, source['type'], source['period'])
+
+            if lastfm_data:
+                # Remove duplicates as we go rather than keeping every copy
+                for album in lastfm.get_albums_from_lastfm_data(lastfm_data, source['type']):
+                    unique_albums.setdefault(album.key, album)
+
+        return list(unique_albums.values())
+
+    raise ValueError(f"Unsupported source type: {source_type}")
+
+# ---------------------------- Check / resolve ---------------------------- #
+
+def check_record(record, lastfm, get_spotify, ledger=None):
+    """Check one album on Last.fm and resolve replacement artwork if missing.
+
+    Fills in the record's lastfm_url, album_art_url and status in place and
+    returns the record. The status is 'has_artwork', 'missing' (artwork found
+    elsewhere and ready to upload), 'unresolvable', 'error' or, when the
+    `ledger` shows a recent upload, 'recently_uploaded' (no API calls made).
+    """
+    if ledger is not None and ledger.recently_uploaded(record.key):
+        record.status = 'recently_uploaded'
+        return record
+
+    with tracing.span('check_album', artist=record.artist, album=record.album):
+        artwork_info = lastfm.check_album_artwork(record.artist, record.album)
+        record.lastfm_url = artwork_info.get('lastfm_url')
+
+        if 'error' in artwork_info:
+            record.status = 'error'
+            record.error = artwork_info['error']
+            return record
+
+        if artwork_info.get('artwork_exists', False):
+            record.status = 'has_artwork'
+            return record
+
+        if not record.album_art_url:
+            # Try to get album art from Spotify and iTunes
+            record.album_art_url = get_album_art_url(get_spotify(), record.artist, record.album)
+
+        record.status = 'missing' if record.album_art_url and record.lastfm_url else 'unresolvable'
+
+    return record
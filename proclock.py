@@ -0,0 +1,30 @@
+# proclock.py
+# Exclusive file locks held for the lifetime of a process
+
+import os
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: no lock, a single process is assumed
+    fcntl = None
+
+def acquire_process_lock(path):
+    """Take an exclusive lock on `path` that is held until this process exits.
+
+    Returns the open lock file (keep a reference to it), True where locking
+    is unsupported, or None if another process holds the lock.
+    """
+    if fcntl is None:
+        return True
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    lock_file = open(path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    lock_file.truncate(0)
+    lock_file.write(f"{os.getpid()}\n")
+    lock_file.flush()
+    return lock_file
@@ -1,30 +1,161 @@
+// Missing artwork is fetched in pages and only the visible rows are rendered
+const MISSING_PAGE_SIZE = 200;
+const MISSING_ROW_HEIGHT = 32;
+const MISSING_OVERSCAN = 10;
+
+// Virtualised list for the job details modal; replaced each time it opens
+let missingArtworkList = null;
+
+class MissingArtworkList {
+    constructor(container, jobId, total) {
+        this.container = container;
+        this.jobId = jobId;
+        this.total = total;
+        this.pages = new Map();
+        this.pending = new Set();
+        // Pages that failed to load are not requested again until the list is reopened
+        this.failed = new Set();
+        this.rows = new Map();
+        this.closed = false;
+
+        this.viewport = document.createElement('div');
+        this.viewport.className = 'virtual-list border rounded';
+        this.spacer = document.createElement('div');
+        this.spacer.style.height = `${total * MISSING_ROW_HEIGHT}px`;
+        this.viewport.appendChild(this.spacer);
+        container.appendChild(this.viewport);
+
+        this.onScroll = () => this.scheduleRender();
+        this.viewport.addEventListener('scroll', this.onScroll, { passive: true });
+        this.scheduleRender();
+    }
+
+    close() {
+        this.closed = true;
+        this.viewport.removeEventListener('scroll', this.onScroll);
+    }
+
+    scheduleRender() {
+        if (this.frame) {
+            return;
+        }
+        this.frame = requestAnimationFrame(() => {
+            this.frame = null;
+            this.render();
+        });
+    }
+
+    visibleRange() {
+        const height = this.viewport.clientHeight || 400;
+        const first = Math.max(Math.floor(this.viewport.scrollTop / MISSING_ROW_HEIGHT) - MISSING_OVERSCAN, 0);
+        const last = Math.min(Math.ceil((this.viewport.scrollTop + height) / MISSING_ROW_HEIGHT) + MISSING_OVERSCAN, this.total);
+        return [first, last];
+    }
+
+    render() {
+        if (this.closed) {
+            return;
+        }
+        const [first, last] = this.visibleRange();
+
+        // Drop rows that scrolled out of view
+        for (const [index, row] of this.rows) {
+            if (index < first || index >= last) {
+                row.remove();
+                this.rows.delete(index);
+            }
+        }
+
+        for (let index = first; index < last; index++) {
+            const page = Math.floor(index / MISSING_PAGE_SIZE);
+            const items = this.pages.get(page);
+            const failed = this.failed.has(page);
+            if (!items && !failed) {
+                this.loadPage(page);
+            }
+            const album = items ? items[index - page * MISSING_PAGE_SIZE] : null;
+            let row = this.rows.get(index);
+            if (!row) {
+                row = document.createElement('div');
+                row.className = 'virtual-list-row';
+                row.style.top = `${index * MISSING_ROW_HEIGHT}px`;
+                this.spacer.appendChild(row);
+                this.rows.set(index, row);
+            }
+            const text = album ? `${album.artist} - ${album.album}` : (failed ? 'Failed to load' : 'Loading...');
+            if (row.textContent !== text) {
+                row.textContent = text;
+                row.classList.toggle('text-muted', !album);
+            }
+        }
+    }
+
+    loadPage(page) {
+        if (this.pending.has(page)) {
+            return;
+        }
+        this.pending.add(page);
+        fetch(`/api/jobs/${encodeURIComponent(this.jobId)}/missing-artwork?offset=${page * MISSING_PAGE_SIZE}&limit=${MISSING_PAGE_SIZE}`)
+            .then((response) => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.json();
+            })
+            .then((result) => {
+                if (!Array.isArray(result.items)) {
+                    throw new Error('Unexpected response');
+                }
+                this.pages.set(page, result.items);
+                this.scheduleRender();
+            })
+            .catch((error) => {
+                console.error('Error loading missing artwork:', error);
+                this.failed.add(page);
+                this.scheduleRender();
+            })
+            .finally(() => {
+                this.pending.delete(page);
+            });
+    }
+}
+
 // Show job details (make this function global)
 function showJobDetails(jobId) {
-    fetch(`/api/job-status/${jobId}`)
+    const jobDetailsContent = document.getElementById('jobDetailsContent');
+    const jobDetailsModal = bootstrap.Modal.getOrCreateInstance(document.getElementById('jobDetailsModal'));
+
+    if (missingArtworkList) {
+        missingArtworkList.close();
+        missingArtworkList = null;
+    }
+
+    fetch(`/api/job-status/${encodeURIComponent(jobId)}`)
         .then((response) => response.json())
         .then((job) => {
-            const jobDetailsContent = document.getElementById('jobDetailsContent');
-            jobDetailsContent.innerHTML = `
-                <p><strong>Status:</strong> ${job.status}</p>
-                <p><strong>Progress:</strong> ${job.progress}%</p>
-                <p><strong>Message:</strong> ${job.message}</p>
-            `;
-            if (job.missing_artwork && job.missing_artwork.length > 0) {
-                jobDetailsContent.innerHTML += `
-                    <h5>Missing Artwork</h5>
-                    <ul>
-                        ${job.missing_artwork.map((album) => `<li>${album.artist} - ${album.album}</li>`).join('')}
-                    </ul>
-                `;
+            jobDetailsContent.innerHTML = '';
+            [['Status', job.status], ['Progress', `${job.progress}%`], ['Message', job.message]].forEach(([label, value]) => {
+                const paragraph = document.createElement('p');
+                const strong = document.createElement('strong');
+                strong.textContent = `${label}:`;
+                paragraph.append(strong, ` ${value}`);
+                jobDetailsContent.appendChild(paragraph);
+            });
+
+            const total = job.missing_artwork_count ?? (job.missing_artwork || []).length;
+            if (total > 0) {
+                const heading = document.createElement('h5');
+                heading.textContent = `Missing Artwork (${total})`;
+                jobDetailsContent.appendChild(heading);
+                jobDetailsModal.show();
+                missingArtworkList = new MissingArtworkList(jobDetailsContent, jobId, total);
+            } else {
+                jobDetailsModal.show();
             }
-            const jobDetailsModal = new bootstrap.Modal(document.getElementById('jobDetailsModal'));
-            jobDetailsModal.show();
         })
         .catch((error) => {
             console.error('Error fetching job details:', error);
-            const jobDetailsContent = document.getElementById('jobDetailsContent');
             jobDetailsContent.innerHTML = '<p class="text-danger">Error loading job details</p>';
-            const jobDetailsModal = new bootstrap.Modal(document.getElementById('jobDetailsModal'));
             jobDetailsModal.show();
         });
 }
@@ -35,6 +166,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const spotifyUrlField = document.getElementById('spotifyUrlField');
     const lastfmUsernameField = document.getElementById('lastfmUsernameField');
     const lastfmSourcesField = document.getElementById('lastfmSourcesField');
+    const historyFileField = document.getElementById('historyFileField');
     const checkOnly = document.getElementById('checkOnly');
     const lastfmCredentialsField = document.getElementById('lastfmCredentialsField');
     const jobsList = document.getElementById('jobsList');
@@ -57,6 +189,20 @@ document.addEventListener('DOMContentLoaded', () => {
         saveSettings();
     });
 
+    // Render the missing artwork list once the modal has its real size
+    const jobDetailsModalElement = document.getElementById('jobDetailsModal');
+    jobDetailsModalElement.addEventListener('shown.bs.modal', () => {
+        if (missingArtworkList) {
+            missingArtworkList.scheduleRender();
+        }
+    });
+    jobDetailsModalElement.addEventListener('hidden.bs.modal', () => {
+        if (missingArtworkList) {
+            missingArtworkList.close();
+            missingArtworkList = null;
+        }
+    });
+
     // Load jobs on page load
     loadJobs();
 
@@ -65,6 +211,7 @@ document.addEventListener('DOMContentLoaded', () => {
         spotifyUrlField.classList.add('hidden');
         lastfmUsernameField.classList.add('hidden');
         lastfmSourcesField.classList.add('hidden');
+        historyFileField.classList.add('hidden');
         lastfmCredentialsField.classList.add('hidden');
 
         if (sourceType.value === 'album' || sourceType.value === 'playlist' || sourceType.value === 'artist') {
@@ -72,6 +219,8 @@ document.addEventListener('DOMContentLoaded', () => {
         } else if (sourceType.value === 'lastfm_username') {
             lastfmUsernameField.classList.remove('hidden');
             lastfmSourcesField.classList.remove('hidden');
+        } else if (sourceType.value === 'history_file') {
+            historyFileField.classList.remove('hidden');
         }
 
         if (!checkOnly.checked) {
@@ -79,11 +228,41 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Upload a history export and return its import ID
+    function uploadHistoryFile() {
+        const file = document.getElementById('historyFile').files[0];
+        if (!file) {
+            return Promise.reject(new Error('No history file selected'));
+        }
+        const formData = new FormData();
+        formData.append('file', file);
+        return fetch('/api/import-history', { method: 'POST', body: formData })
+            .then((response) => response.json().then((result) => {
+                if (!response.ok) {
+                    throw new Error(result.message);
+                }
+                return result.import_id;
+            }));
+    }
+
     // Start a new job
     function startJob() {
+        if (sourceType.value === 'history_file') {
+            uploadHistoryFile()
+                .then((importId) => submitJob(importId))
+                .catch((error) => {
+                    console.error('Error uploading history file:', error);
+                    alert(`Error uploading history file: ${error.message}`);
+                });
+            return;
+        }
+        submitJob(sourceType.value === 'lastfm_username' ? document.getElementById('lastfmUsername').value : document.getElementById('spotifyUrl').value);
+    }
+
+    function submitJob(sourceValue) {
         const data = {
             source_type: sourceType.value,
-            source_value: sourceType.value === 'lastfm_username' ? document.getElementById('lastfmUsername').value : document.getElementById('spotifyUrl').value,
+            source_value: sourceValue,
             check_only: checkOnly.checked,
             lastfm_email: document.getElementById('lastfmEmail').value,
             lastfm_password: document.getElementById('lastfmPassword').value,
@@ -106,29 +285,97 @@ document.addEventListener('DOMContentLoaded', () => {
             });
     }
 
+    // Job cards by job ID, patched in place on every refresh
+    const jobCards = new Map();
+    const JOBS_POLL_INTERVAL = 3000;
+    let jobsPollTimer = null;
+
+    function createJobCard(job) {
+        const card = document.createElement('div');
+        card.className = 'card mb-3';
+        card.innerHTML = `
+            <div class="card-body">
+                <h5 data-field="name"></h5>
+                <p>Status: <span data-field="status"></span></p>
+                <p>Progress: <span data-field="progress"></span>%</p>
+                <p class="small text-muted" data-field="message"></p>
+                <button class="btn btn-sm btn-primary">View Details</button>
+            </div>
+        `;
+        card.querySelector('button').addEventListener('click', () => showJobDetails(job.id));
+        card.fields = {};
+        card.querySelectorAll('[data-field]').forEach((element) => {
+            card.fields[element.dataset.field] = element;
+        });
+        return card;
+    }
+
+    function patchJobCard(card, job) {
+        const values = {
+            name: job.name || job.id,
+            status: job.status,
+            progress: job.progress,
+            message: job.message || '',
+        };
+        Object.entries(values).forEach(([field, value]) => {
+            const text = String(value);
+            if (card.fields[field].textContent !== text) {
+                card.fields[field].textContent = text;
+            }
+        });
+    }
+
     // Load active jobs
     function loadJobs() {
-        jobsList.innerHTML = '<div class="spinner-border text-primary" role="status"><span class="visually-hidden">Loading...</span></div>';
-        fetch('/api/jobs')
+        if (jobsPollTimer) {
+            clearTimeout(jobsPollTimer);
+            jobsPollTimer = null;
+        }
+        fetch('/api/jobs?summary=1')
             .then((response) => response.json())
             .then((jobs) => {
+                jobsList.classList.remove('loading-spinner');
+                const seen = new Set();
+
+                jobs.forEach((job, index) => {
+                    seen.add(job.id);
+                    let card = jobCards.get(job.id);
+                    if (!card) {
+                        card = createJobCard(job);
+                        jobCards.set(job.id, card);
+                    }
+                    patchJobCard(card, job);
+                    // Keep the server's order without moving cards that are already in place
+                    if (jobsList.children[index] !== card) {
+                        jobsList.insertBefore(card, jobsList.children[index] || null);
+                    }
+                });
+
+                for (const [jobId, card] of jobCards) {
+                    if (!seen.has(jobId)) {
+                        card.remove();
+                        jobCards.delete(jobId);
+                    }
+                }
+
+                // Remove the spinner or empty message once cards are shown
+                Array.from(jobsList.children).forEach((child) => {
+                    if (!child.classList.contains('card')) {
+                        child.remove();
+                    }
+                });
                 if (jobs.length === 0) {
                     jobsList.innerHTML = '<p class="text-center">No active jobs</p>';
-                } else {
-                    jobsList.innerHTML = jobs.map((job) => `
-                        <div class="card mb-3">
-                            <div class="card-body">
-                                <h5>${job.name}</h5> <!-- Use the descriptive job name -->
-                                <p>Status: ${job.status}</p>
-                                <p>Progress: ${job.progress}%</p>
-                                <button class="btn btn-sm btn-primary" onclick="showJobDetails('${job.id}')">View Details</button>
-                            </div>
-                        </div>
-                    `).join('');
+                }
+
+                // Keep refreshing while jobs are in progress
+                if (jobs.some((job) => job.status === 'queued' || job.status === 'running')) {
+                    jobsPollTimer = setTimeout(loadJobs, JOBS_POLL_INTERVAL);
                 }
             })
             .catch((error) => {
                 console.error('Error loading jobs:', error);
+                jobCards.clear();
                 jobsList.innerHTML = '<p class="text-danger">Error loading jobs</p>';
             });
     }
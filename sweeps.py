@@ -0,0 +1,280 @@
+# sweeps.py
+# Backlog of albums still missing artwork and the scheduler that re-checks them
+
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from lastfm_artwork_manager import AlbumRecord
+from proclock import acquire_process_lock
+
+logger = logging.getLogger(__name__)
+
+# Statuses that keep an album in the backlog
+BACKLOG_STATUSES = ('missing', 'unresolvable')
+
+# First re-check interval; it doubles after every check with the same result
+FIRST_RECHECK_SECONDS = 24 * 3600
+MAX_RECHECK_SECONDS = 60 * 24 * 3600
+
+# Re-check times are spread by up to this fraction to avoid bursts
+RECHECK_JITTER = 0.1
+
+# Most API calls one album check can make (Last.fm, Spotify search, iTunes search)
+MAX_CALLS_PER_CHECK = 3
+
+# Finished sweep jobs kept in the job list
+SWEEP_HISTORY = 10
+
+# Scheduler defaults, overridable in the config settings
+DEFAULT_SWEEP_SETTINGS = {
+    'SWEEP_INTERVAL_MINUTES': 60,
+    'SWEEP_API_BUDGET': 300
+}
+
+def recheck_interval(checks):
+    """Seconds until the next check of an album checked `checks` times in a row."""
+    interval = min(FIRST_RECHECK_SECONDS * 2 ** max(checks - 1, 0), MAX_RECHECK_SECONDS)
+    return interval * random.uniform(1 - RECHECK_JITTER, 1 + RECHECK_JITTER)
+
+class RecheckBacklog:
+    """Albums last classified as missing or unresolvable, with re-check times.
+
+    Every check stage reports its results here: albums that are missing or
+    unresolvable are (re)scheduled with an exponentially growing interval
+    while their status stays the same, and albums found with artwork are
+    removed.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS backlog (
+            artist_key TEXT NOT NULL,
+            album_key TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            album TEXT NOT NULL,
+            status TEXT NOT NULL,
+            album_art_url TEXT,
+            lastfm_url TEXT,
+            checks INTEGER NOT NULL DEFAULT 1,
+            first_seen REAL NOT NULL,
+            last_checked REAL NOT NULL,
+            next_check REAL NOT NULL,
+            PRIMARY KEY (artist_key, album_key)
+        );
+        CREATE INDEX IF NOT EXISTS backlog_due ON backlog (next_check);
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+
+    def observe(self, records):
+        """Update the backlog with the results of checking `records`."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for record in records:
+                    self._observe(record, now)
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def _observe(self, record, now):
+        artist_key, album_key = record.key
+
+        if record.status == 'has_artwork':
+            self.conn.execute('DELETE FROM backlog WHERE artist_key = ? AND album_key = ?',
+                              (artist_key, album_key))
+            return
+
+        row = self.conn.execute(
+            'SELECT status, checks FROM backlog WHERE artist_key = ? AND album_key = ?',
+            (artist_key, album_key)
+        ).fetchone()
+
+        if record.status not in BACKLOG_STATUSES:
+            # Errors and recent uploads say nothing new; look again later
+            if row is not None:
+                self.conn.execute(
+                    'UPDATE backlog SET next_check = ? WHERE artist_key = ? AND album_key = ?',
+                    (now + recheck_interval(1), artist_key, album_key)
+                )
+            return
+
+        checks = row[1] + 1 if row is not None and row[0] == record.status else 1
+        self.conn.execute(
+            '''INSERT INTO backlog (artist_key, album_key, artist, album, status, album_art_url,
+                                    lastfm_url, checks, first_seen, last_checked, next_check)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (artist_key, album_key) DO UPDATE SET
+                   status = excluded.status,
+                   album_art_url = excluded.album_art_url,
+                   lastfm_url = excluded.lastfm_url,
+                   checks = excluded.checks,
+                   last_checked = excluded.last_checked,
+                   next_check = excluded.next_check''',
+            (artist_key, album_key, record.artist, record.album, record.status,
+             record.album_art_url, record.lastfm_url, checks, now, now,
+             now + recheck_interval(checks))
+        )
+
+    def due(self, limit, now=None):
+        """Return up to `limit` AlbumRecords whose re-check time has passed."""
+        now = time.time() if now is None else now
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT artist, album, album_art_url, lastfm_url FROM backlog '
+                'WHERE next_check <= ? ORDER BY next_check LIMIT ?',
+                (now, limit)
+            ).fetchall()
+        # Artwork URLs are looked up again in case the source has changed
+        return [AlbumRecord(artist, album, lastfm_url=lastfm_url)
+                for artist, album, album_art_url, lastfm_url in rows]
+
+    def stats(self):
+        """Return backlog sizes by status, the number due now and the next due time."""
+        now = time.time()
+        with self.lock:
+            by_status = dict(self.conn.execute(
+                'SELECT status, COUNT(*) FROM backlog GROUP BY status'
+            ).fetchall())
+            due, next_check = self.conn.execute(
+                'SELECT SUM(next_check <= ?), MIN(next_check) FROM backlog', (now,)
+            ).fetchone()
+        return {
+            'total': sum(by_status.values()),
+            'by_status': by_status,
+            'due': due or 0,
+            'next_check': next_check
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class SweepScheduler:
+    """Periodically queues a re-check job for due backlog albums.
+
+    A sweep is only queued while no other job is queued or running, and it
+    gets an API call budget of SWEEP_API_BUDGET; setting
+    SWEEP_INTERVAL_MINUTES to 0 disables sweeps. Old sweep jobs are removed
+    with `discard_job`, which also deletes the files they left behind.
+    """
+
+    def __init__(self, jobs, config_manager, backlog_path, discard_job, on_enqueue=None):
+        self.jobs = jobs
+        self.config_manager = config_manager
+        self.backlog_path = backlog_path
+        self.discard_job = discard_job
+        self.on_enqueue = on_enqueue
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock_file = None
+        self.last_sweep_id = None
+        self.last_run = None
+        self.next_run = None
+
+    def settings(self):
+        settings = dict(DEFAULT_SWEEP_SETTINGS)
+        settings.update({k: v for k, v in self.config_manager.config.get("settings", {}).items()
+                         if k in DEFAULT_SWEEP_SETTINGS})
+        return settings
+
+    def start(self, lock_path=None):
+        """Start the scheduler thread, unless another process holding `lock_path` runs one."""
+        if self.settings()['SWEEP_INTERVAL_MINUTES'] <= 0:
+            logger.info("Background sweeps disabled")
+            return self
+        if lock_path is not None:
+            self.lock_file = acquire_process_lock(lock_path)
+            if self.lock_file is None:
+                logger.info("Background sweeps are scheduled by another process")
+                return self
+        self.thread = threading.Thread(target=self._run, name='sweep-scheduler', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        while True:
+            interval = self.settings()['SWEEP_INTERVAL_MINUTES'] * 60
+            self.next_run = time.time() + interval
+            if self.stop_event.wait(interval):
+                return
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Error scheduling sweep: {e}")
+
+    def run_once(self):
+        """Queue a sweep if the queue is idle and albums are due; return its job ID."""
+        self.last_run = time.time()
+
+        if self.jobs.count('queued', 'running'):
+            logger.info("Skipping sweep: other jobs are queued or running")
+            return None
+
+        backlog = RecheckBacklog(self.backlog_path)
+        try:
+            due = backlog.stats()['due']
+        finally:
+            backlog.close()
+        if not due:
+            return None
+
+        self._prune_history()
+        budget = self.settings()['SWEEP_API_BUDGET']
+        job_id = f"sweep_{int(time.time())}_{uuid.uuid4().hex[:6]}"
+        self.jobs.enqueue({
+            'id': job_id,
+            'status': 'queued',
+            'progress': 0,
+            'message': f'Sweep queued for {due} due albums',
+            'source_type': 'sweep',
+            'source_value': '',
+            'check_only': True,
+            'start_time': time.time()
+        }, {
+            'source_type': 'sweep',
+            'source_value': '',
+            'options': {'api_budget': budget}
+        })
+        self.last_sweep_id = job_id
+        logger.info(f"Queued sweep {job_id} for {due} due albums (budget {budget} API calls)")
+
+        if self.on_enqueue:
+            self.on_enqueue(job_id)
+        return job_id
+
+    def _prune_history(self):
+        """Drop the oldest finished sweep jobs beyond SWEEP_HISTORY."""
+        finished = sorted((job for job in self.jobs.values()
+                           if job.get('source_type') == 'sweep'
+                           and job.get('status') in ('completed', 'failed')),
+                          key=lambda job: job.get('start_time', 0))
+        for job in finished[:max(len(finished) - SWEEP_HISTORY + 1, 0)]:
+            self.discard_job(job)
+
+    def status(self):
+        return {
+            'enabled': self.thread is not None and not self.stop_event.is_set(),
+            'interval_minutes': self.settings()['SWEEP_INTERVAL_MINUTES'],
+            'api_budget': self.settings()['SWEEP_API_BUDGET'],
+            'last_run': self.last_run,
+            'next_run': self.next_run,
+            'last_sweep_id': self.last_sweep_id
+        }
@@ -0,0 +1,193 @@
+# tracing.py
+# Lightweight per-job span recording with Chrome trace-event export
+
+import os
+import json
+import time
+import threading
+from functools import wraps
+from pathlib import Path
+
+# Upper bound on spans kept per job; later spans are counted but not stored
+MAX_SPANS = 100000
+
+_local = threading.local()
+
+# Traces by job ID
+traces = {}
+
+class Trace:
+    """Timed spans recorded for a single job."""
+
+    def __init__(self, job_id, max_spans=MAX_SPANS):
+        self.job_id = job_id
+        self.max_spans = max_spans
+        self.origin = time.perf_counter()
+        self.wall_start = time.time()
+        self.spans = []
+        self.dropped = 0
+        self.thread_names = {}
+        # Spans by category, including those dropped beyond max_spans
+        self.counts = {}
+        self.counts_lock = threading.Lock()
+
+    def add(self, name, cat, start, end, args=None):
+        """Record a finished span; start and end are perf_counter values."""
+        with self.counts_lock:
+            self.counts[cat] = self.counts.get(cat, 0) + 1
+        if len(self.spans) >= self.max_spans:
+            self.dropped += 1
+            return
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+        # list.append is atomic, so worker threads can share a trace
+        self.spans.append((name, cat, start, end, tid, args))
+
+    def count(self, cat):
+        """Number of spans of a category recorded so far, stored or dropped."""
+        return self.counts.get(cat, 0)
+
+    def to_chrome_trace(self):
+        """Return the trace as a Chrome trace-event JSON object."""
+        pid = os.getpid()
+        events = [{
+            'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+            'args': {'name': thread_name}
+        } for tid, thread_name in self.thread_names.items()]
+
+        for name, cat, start, end, tid, args in list(self.spans):
+            event = {
+                'name': name,
+                'cat': cat,
+                'ph': 'X',
+                'ts': round((start - self.origin) * 1e6, 1),
+                'dur': round((end - start) * 1e6, 1),
+                'pid': pid,
+                'tid': tid
+            }
+            if args:
+                event['args'] = args
+            events.append(event)
+
+        return {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'job_id': self.job_id,
+                'start_time': self.wall_start,
+                'dropped_spans': self.dropped
+            }
+        }
+
+class _Span:
+    """Context manager that records one span into the active trace."""
+    __slots__ = ('trace', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, trace, name, cat, args):
+        self.trace = trace
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args = dict(self.args or {}, error=exc_type.__name__)
+        self.trace.add(self.name, self.cat, self.start, time.perf_counter(), self.args)
+        return False
+
+class _NoopSpan:
+    """Shared stand-in used when no trace is active."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+# ---------------------------- Public API ---------------------------- #
+
+def start_trace(job_id):
+    """Create and register a trace for a job."""
+    trace = Trace(job_id)
+    traces[job_id] = trace
+    return trace
+
+def get_trace(job_id):
+    """Return the trace for a job, or None."""
+    return traces.get(job_id)
+
+def save_trace(job_id, directory):
+    """Write a job's trace to `directory` and drop it from memory."""
+    trace = traces.pop(job_id, None)
+    if trace is None:
+        return
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / f"{job_id}.json", 'w') as f:
+        json.dump(trace.to_chrome_trace(), f)
+
+def load_saved_trace(job_id, directory):
+    """Return a trace previously written by save_trace(), or None."""
+    path = Path(directory) / f"{job_id}.json"
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def discard_trace(job_id, directory=None):
+    """Forget the trace for a job, including any saved copy."""
+    traces.pop(job_id, None)
+    if directory is not None:
+        path = Path(directory) / f"{job_id}.json"
+        if path.exists():
+            path.unlink()
+
+def current_trace():
+    """Return the trace active on this thread, or None."""
+    return getattr(_local, 'trace', None)
+
+class activate:
+    """Make a trace the active one for the current thread within a block."""
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self.previous = current_trace()
+        _local.trace = self.trace
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.trace = self.previous
+        return False
+
+def span(name, cat='pipeline', **args):
+    """Time a block as a span of the active trace (no-op without one)."""
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NOOP_SPAN
+    return _Span(trace, name, cat, args or None)
+
+def record(name, start, end, cat='pipeline', **args):
+    """Record an already measured span (perf_counter start/end)."""
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.add(name, cat, start, end, args or None)
+
+def traced(name, cat='api'):
+    """Decorator recording each call of a function as a span."""
+    def decorator(func):
+        @wraps(func)
+        def traced_function(*args, **kwargs):
+            with span(name, cat):
+                return func(*args, **kwargs)
+        return traced_function
+    return decorator
@@ -0,0 +1,551 @@
+# worker.py
+# Job execution, shared by the web app (inline mode) and standalone workers.
+#
+# Usage: JOB_QUEUE_URL=sqlite:///~/.lastfm_artwork_manager/jobs.sqlite3 python -m worker --processes 4
+
+import argparse
+import logging
+import multiprocessing
+import os
+import json
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+from itertools import islice
+
+from lastfm_artwork_manager import (
+    ConfigManager, setup_webdriver, perform_login, perform_upload,
+    download_image, sanitize_filename
+)
+from pipeline import lastfm_client, spotify_factory, upload_ledger, fetch_records, check_record
+from ledger import file_sha256
+from sweeps import RecheckBacklog, MAX_CALLS_PER_CHECK
+from logsetup import setup_logging, process_log_file, log_context, set_stage
+from jobqueue import JobRegistry, open_store
+from pacing import UploadPacer
+from metrics import mark_process_dead
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Seconds a claimed job stays leased without a heartbeat
+LEASE_SECONDS = 60
+
+# Initialize configuration manager
+config_manager = ConfigManager()
+
+# Where finished job traces are written so they don't stay in memory
+TRACE_DIR = config_manager.config_dir / "traces"
+
+# Where large missing artwork lists are kept instead of in the job registry
+RESULTS_DIR = config_manager.config_dir / "results"
+
+# Missing artwork lists longer than this are only stored in RESULTS_DIR
+MISSING_ARTWORK_INLINE_LIMIT = 200
+
+# Uploaded listening history exports waiting to be (or already) imported
+IMPORTS_DIR = config_manager.config_dir / "imports"
+
+# Albums still missing artwork, re-checked by background sweeps
+BACKLOG_PATH = config_manager.config_dir / "backlog.sqlite3"
+
+# Check results are written to the backlog in batches of this size
+BACKLOG_BATCH_SIZE = 500
+
+# Most albums one sweep loads from the backlog
+SWEEP_MAX_ALBUMS = 5000
+
+# Job store: 'memory://' (default, single process) or 'sqlite:///path' (shared)
+store = open_store(os.environ.get('JOB_QUEUE_URL'))
+
+# Job status by job ID, backed by the store
+jobs = JobRegistry(store)
+
+# ---------------------------- Results ---------------------------- #
+
+def write_json_array(path, items):
+    """Write dicts as an indented JSON array without building the list first."""
+    empty = True
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for item in items:
+            f.write('\n    ' if empty else ',\n    ')
+            f.write(json.dumps(item, ensure_ascii=False, indent=4).replace('\n', '\n    '))
+            empty = False
+        f.write(']' if empty else '\n]')
+
+def save_missing_artwork(job_id, records):
+    """Return the job fields describing a job's missing artwork.
+    
+    Small lists are stored in the job itself; larger ones are written to a
+    JSON Lines file so the job registry stays small.
+    """
+    if len(records) <= MISSING_ARTWORK_INLINE_LIMIT:
+        return {'missing_artwork': [record.to_dict() for record in records],
+                'missing_artwork_count': len(records)}
+    
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    path = RESULTS_DIR / f"{job_id}_missing.jsonl"
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record.to_dict(), ensure_ascii=False) + '\n')
+    return {'missing_artwork_file': str(path), 'missing_artwork_count': len(records)}
+
+def read_missing_artwork(job, offset=0, limit=100):
+    """Return one page of a job's missing artwork entries."""
+    if 'missing_artwork_file' not in job:
+        return (job.get('missing_artwork') or [])[offset:offset + limit]
+    
+    path = job['missing_artwork_file']
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in islice(f, offset, offset + limit)]
+
+def discard_missing_artwork(job):
+    """Delete a job's spilled missing artwork file, if any."""
+    path = job.get('missing_artwork_file')
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def discard_job(job):
+    """Remove a finished job from the registry along with its missing artwork file and trace."""
+    del jobs[job['id']]
+    discard_missing_artwork(job)
+    tracing.discard_trace(job['id'], TRACE_DIR)
+
+# ---------------------------- Jobs ---------------------------- #
+
+class LeaseLost(Exception):
+    """Raised inside a job once its worker no longer holds the job's lease."""
+
+def check_lease(lease_lost):
+    """Stop the job if the lease was lost, since another worker may be running it."""
+    if lease_lost is not None and lease_lost.is_set():
+        raise LeaseLost()
+
+def process_albums(job_id, source_type, source_value, lease_lost=None, **kwargs):
+    """Process albums in a background thread, recording a trace of the job
+
+    `lease_lost` is an Event set by the worker's heartbeat; the job stops
+    without touching the job state once it is set.
+    """
+    trace = tracing.start_trace(job_id)
+    ledger = upload_ledger(config_manager)
+    backlog = RecheckBacklog(BACKLOG_PATH)
+    try:
+        with tracing.activate(trace), tracing.span('job', 'job', source_type=source_type), \
+                log_context(job_id=job_id, stage=source_type if source_type == 'sweep' else 'ingest'):
+            if source_type == 'sweep':
+                _sweep_albums(job_id, ledger, backlog, trace, lease_lost, **kwargs)
+            else:
+                _process_albums(job_id, source_type, source_value, ledger, backlog, lease_lost, **kwargs)
+    finally:
+        backlog.close()
+        ledger.close()
+
+def _process_albums(job_id, source_type, source_value, ledger, backlog, lease_lost, lastfm_username=None,
+                    lastfm_sources=None, check_only=False, lastfm_email=None, lastfm_password=None):
+    """Run the fetch, check and upload stages of a job"""
+    logger.info(f"Job {job_id} status: {jobs[job_id]}")
+
+    try:
+        jobs[job_id].update(status='running', progress=0, message='Initializing...')
+        
+        # Spotify is only set up once a stage needs it
+        credentials = config_manager.config["credentials"]
+        get_spotify = spotify_factory(credentials)
+        lastfm = lastfm_client(credentials)
+        
+        # Fetch album records based on input type
+        jobs[job_id]['message'] = f'Fetching data from {source_type}...'
+        ingest_start = time.perf_counter()
+        
+        def set_message(message):
+            jobs[job_id]['message'] = message
+        
+        records = fetch_records(source_type, source_value, lastfm, get_spotify,
+                                lastfm_username=lastfm_username, lastfm_sources=lastfm_sources,
+                                on_message=set_message)
+        
+        tracing.record('ingest', ingest_start, time.perf_counter(), albums=len(records))
+        jobs[job_id]['message'] = f'Found {len(records)} albums. Checking for missing artwork...'
+        jobs[job_id]['total_albums'] = len(records)
+        
+        # Check for missing artwork
+        set_stage('check')
+        no_artwork_urls = []
+        recently_uploaded = 0
+        checked = []
+        total = len(records)
+        
+        for i, record in enumerate(records):
+            check_lease(lease_lost)
+            status = check_record(record, lastfm, get_spotify, ledger).status
+            if status == 'missing':
+                no_artwork_urls.append(record)
+            elif status == 'recently_uploaded':
+                recently_uploaded += 1
+            
+            # Keep the sweep backlog in step with what this job found
+            checked.append(record)
+            if len(checked) >= BACKLOG_BATCH_SIZE:
+                backlog.observe(checked)
+                checked = []
+            
+            # Update progress
+            progress = int((i + 1) / total * 100)
+            jobs[job_id].update(progress=progress, message=f'Checking artwork: {i+1}/{total}')
+        
+        backlog.observe(checked)
+        
+        # Only the albums missing artwork are needed from here on
+        del records, checked
+        jobs[job_id]['recently_uploaded'] = recently_uploaded
+        
+        # Save results to JSON file
+        if no_artwork_urls:
+            artwork_folder = config_manager.config["paths"]["ARTWORK_FOLDER"]
+            json_file_path = f"{job_id}_no_artwork_albums.json"
+            
+            if not os.path.exists(artwork_folder):
+                os.makedirs(artwork_folder)
+                
+            write_json_array(json_file_path, (record.to_dict() for record in no_artwork_urls))
+            
+            jobs[job_id].update(save_missing_artwork(job_id, no_artwork_urls))
+            jobs[job_id]['message'] = f'Found {len(no_artwork_urls)} albums missing artwork'
+        else:
+            jobs[job_id].update(missing_artwork=[], missing_artwork_count=0)
+            jobs[job_id]['message'] = 'All albums have artwork!'
+            jobs[job_id]['status'] = 'completed'
+            return
+        
+        # Exit if check-only mode
+        if check_only:
+            jobs[job_id]['message'] = f'Check completed. Found {len(no_artwork_urls)} albums missing artwork.'
+            jobs[job_id]['status'] = 'completed'
+            return
+        
+        # Upload artwork if credentials are provided
+        if lastfm_email and lastfm_password:
+            set_stage('upload')
+            jobs[job_id]['message'] = 'Setting up browser for uploads...'
+            
+            # Define element selectors for Last.fm
+            selectors = {
+                'username_or_email': 'id_username_or_email',
+                'password': 'id_password',
+                'post_login': 'top-artists',
+                'file_input': '//input[@type="file"]',
+                'album_title': 'title',
+                'upload_button': '.btn-primary',
+                'upload_success': '.gallery-image-uploaded-by'
+            }
+            
+            # Force headless mode for server
+            config_manager.config["settings"]["HEADLESS"] = True
+            
+            # Initialize WebDriver
+            driver = setup_webdriver()
+            pacer = UploadPacer.from_settings(config_manager.config.get("settings"), report_gap=True)
+            
+            try:
+                # Perform login
+                jobs[job_id]['message'] = 'Logging in to Last.fm...'
+                login_success = perform_login(driver, lastfm_email, lastfm_password, selectors, pacer)
+                
+                if not login_success:
+                    jobs[job_id]['message'] = 'Login failed'
+                    jobs[job_id]['status'] = 'failed'
+                    driver.quit()
+                    return
+                
+                # Process each album for upload
+                successful_uploads = 0
+                failed_uploads = 0
+                skipped_uploads = 0
+                
+                jobs[job_id]['message'] = 'Starting uploads...'
+                jobs[job_id]['progress'] = 0
+                
+                for i, album_entry in enumerate(no_artwork_urls):
+                    artist = album_entry.artist
+                    album = album_entry.album
+                    album_art_url = album_entry.album_art_url
+                    lastfm_url = album_entry.lastfm_url
+                    
+                    if not all([artist, album, album_art_url, lastfm_url]):
+                        logger.warning(f"Missing data in entry: {album_entry}")
+                        continue
+                    
+                    # Prepare upload URL
+                    upload_url = lastfm_url.rstrip('/') + '/+images/upload'
+                    
+                    # Prepare image path
+                    filename = f"{sanitize_filename(artist)} - {sanitize_filename(album)}.jpg"
+                    image_path = os.path.join(config_manager.config["paths"]["ARTWORK_FOLDER"], filename)
+                    
+                    check_lease(lease_lost)
+                    
+                    # Another job may have uploaded this album since it was checked,
+                    # or be uploading it now
+                    if not ledger.claim(album_entry.key):
+                        logger.info(f"Skipping '{artist} - {album}': uploaded recently or in progress")
+                        skipped_uploads += 1
+                        continue
+                    
+                    # Drop the claim if the job stops before the outcome is recorded
+                    try:
+                        album_start = time.perf_counter()
+                        jobs[job_id]['message'] = f'Downloading artwork for "{artist} - {album}"'
+                        
+                        # Download the album art image if it doesn't exist
+                        if not os.path.exists(image_path):
+                            success = download_image(album_art_url, image_path, pacer)
+                            if not success:
+                                logger.error(f"Failed to download image for '{album}'")
+                                ledger.release(album_entry.key)
+                                failed_uploads += 1
+                                continue
+                        
+                        image_hash = file_sha256(image_path)
+                        if ledger.image_uploaded(album_entry.key, image_hash):
+                            logger.info(f"Skipping '{artist} - {album}': this image was already uploaded")
+                            ledger.release(album_entry.key)
+                            skipped_uploads += 1
+                            continue
+                        
+                        # Keep uploads apart by the adaptive gap to prevent rate limiting
+                        pacer.wait_for_next()
+                        check_lease(lease_lost)
+                        jobs[job_id]['message'] = f'Uploading artwork for "{artist} - {album}"'
+                        
+                        # Upload the image
+                        upload_success = perform_upload(driver, album_entry, image_path, upload_url, selectors, pacer)
+                        ledger.record(album_entry.key, image_hash, upload_success)
+                    except BaseException:
+                        ledger.release(album_entry.key)
+                        raise
+                    
+                    if upload_success:
+                        successful_uploads += 1
+                        logger.info(f"Upload successful for '{artist} - {album}'")
+                    else:
+                        failed_uploads += 1
+                        logger.error(f"Upload failed for '{artist} - {album}'")
+                    
+                    tracing.record('upload_album', album_start, time.perf_counter(),
+                                   artist=artist, album=album, success=upload_success)
+                    
+                    # Update progress
+                    progress = int((i + 1) / len(no_artwork_urls) * 100)
+                    jobs[job_id]['progress'] = progress
+                
+                jobs[job_id]['successful_uploads'] = successful_uploads
+                jobs[job_id]['failed_uploads'] = failed_uploads
+                jobs[job_id]['skipped_uploads'] = skipped_uploads
+                jobs[job_id]['message'] = (f'Upload completed. Successful: {successful_uploads}, '
+                                           f'Failed: {failed_uploads}, Skipped: {skipped_uploads}')
+                jobs[job_id]['status'] = 'completed'
+                
+            except LeaseLost:
+                raise
+            except Exception as e:
+                logger.error(f"Error during upload process: {e}")
+                jobs[job_id]['message'] = f'Error during upload process: {str(e)}'
+                jobs[job_id]['status'] = 'failed'
+            finally:
+                # Close the WebDriver
+                driver.quit()
+                logger.info("WebDriver closed")
+        else:
+            jobs[job_id]['message'] = 'Check completed. Last.fm credentials not provided for upload.'
+            jobs[job_id]['status'] = 'completed'
+            
+    except LeaseLost:
+        raise
+    except Exception as e:
+        logger.error(f"Error in job {job_id}: {str(e)}")
+        jobs[job_id]['message'] = f'Error: {str(e)}'
+        jobs[job_id]['status'] = 'failed'
+
+def _sweep_albums(job_id, ledger, backlog, trace, lease_lost, api_budget):
+    """Re-check due backlog albums until the API budget is spent or other work arrives"""
+    try:
+        jobs[job_id].update(status='running', progress=0, message='Loading due albums...')
+        
+        credentials = config_manager.config["credentials"]
+        get_spotify = spotify_factory(credentials)
+        lastfm = lastfm_client(credentials)
+        
+        records = backlog.due(SWEEP_MAX_ALBUMS)
+        total = len(records)
+        counts = {}
+        resolved = []
+        stopped = 'done'
+        # API calls are counted by the trace for this job
+        first_count = trace.count('api')
+        
+        for i, record in enumerate(records):
+            check_lease(lease_lost)
+            api_calls = trace.count('api') - first_count
+            if api_calls + MAX_CALLS_PER_CHECK > api_budget:
+                stopped = 'budget'
+                break
+            if jobs.count('queued', 'running') > 1:
+                # Sweeps only use idle time (the sweep itself is the one running job);
+                # the rest waits for the next sweep
+                stopped = 'preempted'
+                break
+            
+            status = check_record(record, lastfm, get_spotify, ledger).status
+            counts[status] = counts.get(status, 0) + 1
+            if status == 'missing':
+                resolved.append(record)
+            backlog.observe([record])
+            
+            jobs[job_id].update(progress=int((i + 1) / total * 100),
+                                message=f'Re-checking artwork: {i+1}/{total}')
+        
+        checked = sum(counts.values())
+        jobs[job_id].update(
+            sweep={
+                'due': total,
+                'checked': checked,
+                'api_calls': trace.count('api') - first_count,
+                'api_budget': api_budget,
+                'stopped': stopped,
+                'results': counts,
+                'backlog': backlog.stats()
+            },
+            total_albums=checked
+        )
+        jobs[job_id].update(save_missing_artwork(job_id, resolved))
+        jobs[job_id].update(
+            progress=100, status='completed',
+            message=(f'Sweep re-checked {checked} of {total} due albums: '
+                     f"{counts.get('has_artwork', 0)} now have artwork, "
+                     f'{len(resolved)} ready to upload')
+        )
+    except LeaseLost:
+        raise
+    except Exception as e:
+        logger.error(f"Error in sweep {job_id}: {str(e)}")
+        jobs[job_id]['message'] = f'Error: {str(e)}'
+        jobs[job_id]['status'] = 'failed'
+
+# ---------------------------- Workers ---------------------------- #
+
+class Worker:
+    """Claims jobs from the store and runs them while keeping the lease alive."""
+
+    def __init__(self, store, worker_id=None, lease_seconds=LEASE_SECONDS, poll_interval=2.0):
+        self.store = store
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+    def run_once(self, job_id=None):
+        """Run the next available job (or only `job_id`); return False if there was none."""
+        claimed = self.store.claim(self.worker_id, self.lease_seconds, job_id)
+        if claimed is None:
+            return False
+
+        job_id, params = claimed
+        logger.info(f"Worker {self.worker_id} claimed job {job_id}")
+        stop = threading.Event()
+        lost = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, stop, lost), daemon=True)
+        heartbeat.start()
+
+        try:
+            if self.store.shared:
+                # Settings may have been changed by another process
+                config_manager.config = config_manager.load_config()
+            process_albums(job_id, params['source_type'], params['source_value'],
+                           lease_lost=lost, **params['options'])
+        except LeaseLost:
+            logger.warning(f"Worker {self.worker_id} stopped job {job_id} after losing its lease")
+        except Exception as e:
+            # Errors the job could not record itself, e.g. from opening the ledger
+            logger.error(f"Error running job {job_id}: {str(e)}")
+            if not lost.is_set() and self.store.heartbeat(job_id, self.worker_id, self.lease_seconds):
+                jobs[job_id].update(status='failed', message=f'Error: {str(e)}')
+        finally:
+            stop.set()
+            heartbeat.join()
+            self.store.finish(job_id, self.worker_id)
+            if lost.is_set():
+                # The worker now running the job saves its own trace
+                tracing.discard_trace(job_id)
+            else:
+                tracing.save_trace(job_id, TRACE_DIR)
+        return True
+
+    def run_forever(self, stop=None):
+        """Poll for jobs until `stop` is set."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            if not self.run_once():
+                stop.wait(self.poll_interval)
+
+    def _heartbeat(self, job_id, stop, lost):
+        while not stop.wait(self.lease_seconds / 3.0):
+            if not self.store.heartbeat(job_id, self.worker_id, self.lease_seconds):
+                logger.warning(f"Worker {self.worker_id} lost the lease on job {job_id}")
+                lost.set()
+                return
+
+def _run_worker_process(lease_seconds, poll_interval):
+    """Entry point for each worker process."""
+    setup_logging(process_log_file(config_manager, 'worker'))
+    try:
+        Worker(store, lease_seconds=lease_seconds, poll_interval=poll_interval).run_forever()
+    except KeyboardInterrupt:
+        pass
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m worker', description='Run job worker processes.')
+    parser.add_argument('--processes', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--lease-seconds', type=float, default=LEASE_SECONDS)
+    parser.add_argument('--poll-interval', type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    if not store.shared:
+        parser.error('set JOB_QUEUE_URL to a shared queue, e.g. sqlite:///~/.lastfm_artwork_manager/jobs.sqlite3')
+
+    if args.processes == 1:
+        _run_worker_process(args.lease_seconds, args.poll_interval)
+        return
+
+    # Spawned children import this module afresh and open their own store connection
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_run_worker_process, name=f'worker-{i}',
+                                 args=(args.lease_seconds, args.poll_interval))
+                 for i in range(args.processes)]
+    for process in processes:
+        process.start()
+
+    # Treat SIGTERM (docker stop) like Ctrl+C so the children are stopped too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Jobs interrupted here are picked up again once their lease expires
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+            # Children stopped with terminate() skip their own cleanup
+            mark_process_dead(process.pid)
+
+if __name__ == '__main__':
+    main()